@@ -0,0 +1,107 @@
+import datetime
+
+from blockchain import MICROSECOND
+
+
+class CommitError(Exception):
+    """Raised when a batch cannot be committed. None of its events is added."""
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class Batch:
+    """
+    Events staged to be added to the BlockChains of patients, events and doctors at once.
+
+    The incompatibilities of the whole batch are checked before anything is written, then the blocks are appended to
+    every affected chain and each chain is verified once. If anything fails, the chains are truncated back to their
+    previous length.
+    """
+
+    def __init__(self):
+        # Staged (doctor, event, patient) triples, in order
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, doctor, event, patient):
+        """
+        Stage an event.
+
+        Parameters
+        ----------
+        doctor : Doctor
+            Doctor who is adding the event.
+        event : Event
+            Event that is being added.
+        patient : Patient
+            Patient that is facing this event.
+
+        Returns
+        -------
+        batch : Batch
+        """
+        if doctor.player != "doctor":
+            raise PermissionError("Only doctors can add events.")
+        self.entries.append((doctor, event, patient))
+        return self
+
+    def validate(self):
+        """
+        Check the incompatibilities of the staged events, with the past events of the patients and with the events
+        staged before them.
+
+        Raises
+        ------
+        IncompatibilityError
+            If an event is not compatible with a previous one.
+        """
+        staged = {}
+        for doctor, event, patient in self.entries:
+            names = staged.setdefault(id(patient), set())
+            patient.check_event(event, names)
+            names.add(event.name)
+
+    def commit(self):
+        """
+        Add the staged events to the BlockChains of the patients, of the events and of the doctors, then empty the
+        batch.
+
+        Raises
+        ------
+        IncompatibilityError
+            If an event is not compatible with a previous one. Nothing is written.
+        CommitError
+            If a chain is corrupted after the append. The chains are restored.
+        """
+        self.validate()
+        now = datetime.datetime.utcnow()
+        # Length of each affected chain before the batch
+        lengths = {}
+        # Events that were not in the history of each patient before the batch
+        seen = {}
+        try:
+            for doctor, event, patient in self.entries:
+                for chain, args in ((patient, (event, doctor)), (event, (patient, doctor)), (doctor, (event, patient))):
+                    if id(chain) not in lengths:
+                        lengths[id(chain)] = chain, len(chain.blocks)
+                    # Blocks of the same batch are one microsecond apart, so that they never share a timestamp
+                    timestamp = max(now, chain.blocks.timestamp(-1) + MICROSECOND)
+                    chain.blocks.append(chain.new_block(*args, timestamp=timestamp))
+                if event.name not in patient.seen_events:
+                    patient.seen_events.add(event.name)
+                    seen.setdefault(id(patient), (patient, []))[1].append(event.name)
+
+            for chain, _ in lengths.values():
+                verified, message = chain.verify()
+                if not verified:
+                    raise CommitError(f"{chain.player} {chain.name}: {message}")
+        except Exception:
+            for chain, length in lengths.values():
+                chain.blocks.truncate(length)
+                chain.verified = min(chain.verified, length - 1)
+            for patient, names in seen.values():
+                patient.seen_events.difference_update(names)
+            raise
+        self.entries = []
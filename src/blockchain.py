@@ -1,15 +1,40 @@
 import hashlib
 import datetime
+import sys
+from array import array
+
 import pandas as pd
 
+# Labels of the summary of a block, for each player
+SUMMARY_LABELS = {
+    "patient": ["Index", "Name", "Doctor", "Timestamp", "Event", "Kind", "Previous hash", "Hash"],
+    "event": ["Index", "Name", "Patient", "Doctor", "Timestamp", "Previous hash", "Hash"],
+    "doctor": ["Index", "Name", "Patient", "Timestamp", "Event", "Kind", "Previous hash", "Hash"],
+}
+# Attributes of the block shown under each label of the summary
+SUMMARY_FIELDS = {
+    "patient": ["index", "name", "doctor", "timestamp", "kind", "data", "previous_hash", "hash"],
+    "event": ["index", "name", "patient", "doctor", "timestamp", "previous_hash", "hash"],
+    "doctor": ["index", "name", "patient", "timestamp", "kind", "data", "previous_hash", "hash"],
+}
+
+# Attributes of the block stored as codes in the table of strings of the chain
+STRING_FIELDS = ("player", "name", "event", "kind", "patient", "doctor", "data")
+GENESIS_PREVIOUS_HASH = "0" * 64
+# Origin of the timestamps stored as microseconds
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
 
 class Block:
     """
     Minimal block containing an index, a timestamp, the data to store and the previous hash.
     """
+    __slots__ = ("index", "player", "event", "name", "timestamp", "kind", "patient", "doctor", "data",
+                 "previous_hash", "hash")
 
     def __init__(self, index, name, player, timestamp, previous_hash,
-                 doctor=None, data=None, kind=None, patient=None, event=None):
+                 doctor=None, data=None, kind=None, patient=None, event=None, hash=None):
         self.index = index
         self.player = player
         self.event = event
@@ -20,7 +45,7 @@ class Block:
         self.doctor = doctor
         self.data = data
         self.previous_hash = previous_hash
-        self.hash = self.hashing()
+        self.hash = self.hashing() if hash is None else hash
 
     def hashing(self):
         key = hashlib.sha256()
@@ -30,34 +55,162 @@ class Block:
         key.update(str(self.previous_hash).encode('utf-8'))
         return key.hexdigest()
 
+    def summary_values(self):
+        """
+        Return the values shown in the summary of the block, in the order of `SUMMARY_LABELS`.
+        """
+        return [getattr(self, field) for field in SUMMARY_FIELDS[self.player]]
+
     def summary(self):
-        if self.player == "patient":
-            return pd.DataFrame({"Block summary": [self.index, self.name, self.doctor, self.timestamp, self.kind,
-                                                   self.data, self.previous_hash, self.hash]},
-                                index=["Index", "Name", "Doctor", "Timestamp", "Event", "Kind",
-                                       "Previous hash", "Hash"])
+        return pd.DataFrame({"Block summary": self.summary_values()}, index=SUMMARY_LABELS[self.player])
+
+
+class ChainStore:
+    """
+    Blocks of a chain stored by columns: timestamps as microseconds, hashes as 32 bytes and the other attributes as
+    codes of a table of interned strings. The index and the previous hash of each block follow from its position.
+    `Block` objects are only built when a block is accessed.
+    """
+
+    def __init__(self, blocks=()):
+        """
+        Parameters
+        ----------
+        blocks : iterable of Block
+            Blocks to be stored, starting from the genesis block.
+        """
+        self.timestamps = array("q")
+        self.hashes = bytearray()
+        self.fields = {field: array("I") for field in STRING_FIELDS}
+        # Strings of the chain, the code of each one is its position
+        self.strings = [None]
+        self.codes = {None: 0}
+        for block in blocks:
+            self.append(block)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        n = self._position(n)
+        strings = self.strings
+        values = {field: strings[codes[n]] for field, codes in self.fields.items()}
+        return Block(n, timestamp=EPOCH + self.timestamps[n] * MICROSECOND, previous_hash=self._previous_hash(n),
+                     hash=self.hashes[32 * n:32 * (n + 1)].hex(), **values)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def _position(self, n):
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("Block index out of range.")
+        return n
+
+    def _code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            if isinstance(value, str):
+                value = sys.intern(value)
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def append(self, block):
+        """
+        Append a block to the store.
+
+        Parameters
+        ----------
+        block : Block
+
+        Raises
+        ------
+        ValueError
+            If the index or the previous hash of the block do not follow the last block of the store.
+        """
+        n = len(self.timestamps)
+        if block.index != n:
+            raise ValueError(f"Block {block.index} cannot follow block {n - 1}.")
+        if block.previous_hash != self._previous_hash(n):
+            raise ValueError(f"The previous hash of block {block.index} does not match the hash of the last block.")
+        for field, codes in self.fields.items():
+            codes.append(self._code(getattr(block, field)))
+        self.timestamps.append((block.timestamp - EPOCH) // MICROSECOND)
+        self.hashes += bytes.fromhex(block.hash)
+
+    def truncate(self, count):
+        """
+        Remove the blocks from index `count` onwards.
 
-        if self.player == "event":
-            return pd.DataFrame({"Block summary": [self.index, self.name, self.patient, self.doctor, self.timestamp,
-                                                   self.previous_hash, self.hash]},
-                                index=["Index", "Name", "Patient", "Doctor", "Timestamp",
-                                       "Previous hash", "Hash"])
+        Parameters
+        ----------
+        count : int
+            Number of blocks to keep.
+        """
+        del self.timestamps[count:]
+        del self.hashes[32 * count:]
+        for codes in self.fields.values():
+            del codes[count:]
+
+    def timestamp(self, n):
+        return EPOCH + self.timestamps[self._position(n)] * MICROSECOND
 
-        if self.player == "doctor":
-            return pd.DataFrame({"Block summary": [self.index, self.name, self.patient, self.timestamp, self.kind,
-                                                   self.data, self.previous_hash, self.hash]},
-                                index=["Index", "Name", "Patient", "Timestamp", "Event", "Kind",
-                                       "Previous hash", "Hash"])
+    def hash(self, n):
+        n = self._position(n)
+        return self.hashes[32 * n:32 * (n + 1)].hex()
+
+    def previous_hash(self, n):
+        return self._previous_hash(self._position(n))
+
+    def _previous_hash(self, n):
+        return self.hashes[32 * (n - 1):32 * n].hex() if n > 0 else GENESIS_PREVIOUS_HASH
+
+    def column(self, field, start=0, stop=None):
+        """
+        Return the values of an attribute for a range of blocks, without building the blocks.
+
+        Parameters
+        ----------
+        field : str
+            Attribute of the blocks, e.g. "timestamp" or "hash".
+        start : int
+            Index of the first block.
+        stop : int, default None
+            Index after the last block. If None, up to the end of the chain.
+
+        Returns
+        -------
+        values : list
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if field == "index":
+            return list(range(start, stop))
+        if field == "timestamp":
+            return [EPOCH + timestamp * MICROSECOND for timestamp in self.timestamps[start:stop]]
+        if field == "hash":
+            return [self.hashes[32 * n:32 * (n + 1)].hex() for n in range(start, stop)]
+        if field == "previous_hash":
+            return [self._previous_hash(n) for n in range(start, stop)]
+        strings = self.strings
+        return [strings[code] for code in self.fields[field][start:stop]]
 
 
 class BlockChain:
+    # Index of the last block verified, the blocks up to it are not checked again
+    verified = 0
+
     def __init__(self, player, name):
         """
         Always initialize a genesis block when creating a new chain.
         """
         self.name = name
         self.player = player
-        self.blocks = [self.get_genesis_block()]
+        self.blocks = ChainStore([self.get_genesis_block()])
 
     def get_genesis_block(self):
         """
@@ -72,23 +225,36 @@ class BlockChain:
         """
         return len(self.blocks) - 1
 
-    def verify(self):
+    def verify(self, full=False):
         """
         Verify data integrity:
 
         * index in `blocks[i]` is `i`, there are no missing or extra blocks;
         * current and previous hashes are correct;
         * there is not any backdating.
+
+        Only the blocks appended since the last successful verification are checked, unless `full` is True.
+
+        Parameters
+        ----------
+        full : bool, default False
+            If True, verify the whole chain from the genesis block, e.g. to audit it.
         """
-        for i in range(1, len(self.blocks)):
-            if self.blocks[i].index != i:
+        start = 1 if full else min(self.verified, len(self.blocks) - 1) + 1
+        previous = self.blocks[start - 1]
+        for i in range(start, len(self.blocks)):
+            block = self.blocks[i]
+            if block.index != i:
                 return False, f'Wrong block index at block {i}.'
-            if self.blocks[i - 1].hash != self.blocks[i].previous_hash:
+            if previous.hash != block.previous_hash:
                 return False, f'Wrong previous hash at block {i}.'
-            if self.blocks[i].hash != self.blocks[i].hashing():
+            if block.hash != block.hashing():
                 return False, f'Wrong hash at block {i}.'
-            if self.blocks[i - 1].timestamp >= self.blocks[i].timestamp:
+            if previous.timestamp >= block.timestamp:
                 return False, f'Backdating at block {i}.'
+            previous = block
+            self.verified = i
+        self.verified = len(self.blocks) - 1
         return True, 'The BlockChain is not corrupted.'
 
     def get_block(self, n):
@@ -102,6 +268,25 @@ class BlockChain:
         """
         return self.blocks[n].summary()
 
+    def get_columns(self, start=0, stop=None):
+        """
+        Return the summaries of a range of blocks by columns, read from the store of the chain.
+
+        Parameters
+        ----------
+        start : int
+            Index of the first block.
+        stop : int, default None
+            Index after the last block. If None, up to the end of the chain.
+
+        Returns
+        -------
+        columns : dict
+            Dictionary mapping each label of the summary to the list of its values.
+        """
+        return {label: self.blocks.column(field, start, stop)
+                for label, field in zip(SUMMARY_LABELS[self.player], SUMMARY_FIELDS[self.player])}
+
     def get_chain(self):
         """
         Return a pandas DataFrame containing all the blocks of the chain.
@@ -110,9 +295,6 @@ class BlockChain:
         -------
         chain : pandas.DataFrame
         """
-        chain = pd.DataFrame()
-        for block in self.blocks:
-            block_T = block.summary().T
-            chain = chain.append(block_T)
+        chain = pd.DataFrame(self.get_columns(), columns=SUMMARY_LABELS[self.player])
         chain.set_index("Index", inplace=True)
         return chain
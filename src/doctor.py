@@ -1,25 +1,44 @@
 import datetime
 
-from blockchain import BlockChain, Block
+from batch import Batch
+from blockchain import BlockChain, Block, ChainStore
+from registry import registry as default_registry
 
 
 class Doctor(BlockChain):
     """
     Doctor object.
     """
-    def __init__(self, name, *args, **kw):
+    def __init__(self, name, registry=None, *args, **kw):
         super(BlockChain, self).__init__(*args, **kw)
         self.name = name
         self.player = "doctor"
-        self.blocks = [self.get_genesis_block()]
+        self.blocks = ChainStore([self.get_genesis_block()])
+        (registry or default_registry).register(self)
 
     def add_block(self, event, patient):
-        self.blocks.append(Block(len(self.blocks), player=self.player, name=self.name, patient=patient.name,
-                                 timestamp=datetime.datetime.utcnow(), kind=event.event, data=event.name,
-                                 previous_hash=self.blocks[len(self.blocks) - 1].hash))
+        self.blocks.append(self.new_block(event, patient))
 
-        if not self.verify()[0]:
-            print(f"WARNING: {self.verify()[1]}")
+        verified, message = self.verify()
+        if not verified:
+            print(f"WARNING: {message}")
+
+    def new_block(self, event, patient, timestamp=None):
+        """
+        Return the block that follows the last one of the chain, without appending it.
+
+        Parameters
+        ----------
+        event : :obj:`Event`
+            The Blockchain relative to the event that the patient faces.
+        patient : :obj:`Patient`
+            The BlockChain relative to the patient that faces the event.
+        timestamp : datetime.datetime, default None
+            Timestamp of the block. If None, the current time.
+        """
+        return Block(len(self.blocks), player=self.player, name=self.name, patient=patient.name,
+                     timestamp=timestamp or datetime.datetime.utcnow(), kind=event.event, data=event.name,
+                     previous_hash=self.blocks.hash(len(self.blocks) - 1))
 
     def add_event(self, event, patient):
         """
@@ -32,6 +51,4 @@ class Doctor(BlockChain):
         patient : :obj:`Patient`
             The BlockChain relative to the patient that faces the event.
         """
-        patient.add_block(event, doctor=self)
-        event.add_block(patient, doctor=self)
-        self.add_block(event, patient)
+        Batch().add(self, event, patient).commit()
@@ -1,6 +1,7 @@
 import datetime
 
-from blockchain import BlockChain, Block
+from blockchain import BlockChain, Block, ChainStore
+from registry import registry as default_registry
 
 
 def count_player(loc, player):
@@ -57,19 +58,36 @@ class Event(BlockChain):
     Event object. It could be a disease, a prescription, a surgery, etc.
     """
 
-    def __init__(self, event, name, loc, incompatibilities=None, *args, **kw):
+    def __init__(self, event, name, loc=None, incompatibilities=None, registry=None, *args, **kw):
+        """
+        Parameters
+        ----------
+        event : str
+            Kind of event, e.g. "disease" or "prescription".
+        name : str
+            Name of the event.
+        loc : dict, default None
+            Dictionary associated with the current local symbol table, kept for backward compatibility. If given, the
+            incompatibilities are also added to the events among its values whose variable name matches them.
+        incompatibilities : list, default None
+            Names of the events that are not compatible with this event.
+        registry : Registry, default None
+            Registry the event is added to. If None, the registry of the process.
+        """
         super(BlockChain, self).__init__(*args, **kw)
         if incompatibilities is None:
             incompatibilities = []
         self.player = "event"
         self.name = name
         self.event = event
-        self.blocks = [self.get_genesis_block()]
-        self.incompatibilities = incompatibilities
+        self.blocks = ChainStore([self.get_genesis_block()])
 
         if not isinstance(incompatibilities, (list, type(None))):
             raise Exception("`incompatibilities` should be a `list` or `None`")
-        add_incompatibilities(self, incompatibilities, loc)
+        self.incompatibilities = set(incompatibilities)
+        if loc is not None:
+            add_incompatibilities(self, incompatibilities, loc)
+        (registry or default_registry).register(self)
 
     def add_block(self, patient, doctor):
         """
@@ -82,12 +100,28 @@ class Event(BlockChain):
         doctor : :obj:`Doctor`
             BlockChain relative to the doctor that adds the event to the chain of the patient.
         """
-        self.blocks.append(Block(len(self.blocks), event=self.event, name=self.name, player=self.player,
-                                 doctor=doctor.name, timestamp=datetime.datetime.utcnow(), patient=patient.name,
-                                 previous_hash=self.blocks[len(self.blocks) - 1].hash))
+        self.blocks.append(self.new_block(patient, doctor))
+
+        verified, message = self.verify()
+        if not verified:
+            print(f"WARNING: {message}")
+
+    def new_block(self, patient, doctor, timestamp=None):
+        """
+        Return the block that follows the last one of the chain, without appending it.
 
-        if not self.verify()[0]:
-            print(f"WARNING: {self.verify()[1]}")
+        Parameters
+        ----------
+        patient : :obj:`Patient`
+            BlockChain relative to the patient that faced this event.
+        doctor : :obj:`Doctor`
+            BlockChain relative to the doctor that adds the event to the chain of the patient.
+        timestamp : datetime.datetime, default None
+            Timestamp of the block. If None, the current time.
+        """
+        return Block(len(self.blocks), event=self.event, name=self.name, player=self.player, doctor=doctor.name,
+                     timestamp=timestamp or datetime.datetime.utcnow(), patient=patient.name,
+                     previous_hash=self.blocks.hash(len(self.blocks) - 1))
 
     def add_incompatibility(self, incompatibility):
         """
@@ -98,4 +132,4 @@ class Event(BlockChain):
         incompatibility : str
             Name of the event that is not compatible with this event.
         """
-        self.incompatibilities.append(incompatibility)
+        self.incompatibilities.add(incompatibility)
@@ -0,0 +1,90 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from blockchain import SUMMARY_LABELS
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Exporting to Arrow or Parquet requires pyarrow, install it with `pip install pyarrow`.")
+
+
+def get_schema(player):
+    """
+    Return the Arrow schema of the chains of a player.
+
+    Parameters
+    ----------
+    player : str
+        Either "patient", "event" or "doctor".
+
+    Returns
+    -------
+    schema : pyarrow.Schema
+    """
+    _require_pyarrow()
+    types = {"Index": pa.int64(), "Timestamp": pa.timestamp("us")}
+    return pa.schema([(label, types.get(label, pa.string())) for label in SUMMARY_LABELS[player]])
+
+
+def iter_batches(chain, batch_size=65536):
+    """
+    Iterate over the blocks of a chain as Arrow record batches, so that the whole chain is never
+    held in memory as a DataFrame.
+
+    Parameters
+    ----------
+    chain : BlockChain
+        BlockChain to be exported.
+    batch_size : int
+        Number of blocks in each batch.
+
+    Returns
+    -------
+    Generator of pyarrow.RecordBatch.
+    """
+    schema = get_schema(chain.player)
+    for start in range(0, len(chain.blocks), batch_size):
+        columns = chain.get_columns(start, start + batch_size)
+        yield pa.record_batch([columns[label] for label in schema.names], schema=schema)
+
+
+def write_parquet(chain, path, batch_size=65536):
+    """
+    Write a chain to a Parquet file, one row group per batch of blocks.
+
+    Parameters
+    ----------
+    chain : BlockChain
+        BlockChain to be exported.
+    path : str
+        Path of the Parquet file.
+    batch_size : int
+        Number of blocks in each row group.
+    """
+    _require_pyarrow()
+    with pq.ParquetWriter(path, get_schema(chain.player)) as writer:
+        for batch in iter_batches(chain, batch_size):
+            writer.write_batch(batch)
+
+
+def write_arrow(chain, path, batch_size=65536):
+    """
+    Write a chain to an Arrow IPC file, one record batch per batch of blocks.
+
+    Parameters
+    ----------
+    chain : BlockChain
+        BlockChain to be exported.
+    path : str
+        Path of the Arrow file.
+    batch_size : int
+        Number of blocks in each record batch.
+    """
+    _require_pyarrow()
+    with pa.ipc.new_file(path, get_schema(chain.player)) as writer:
+        for batch in iter_batches(chain, batch_size):
+            writer.write_batch(batch)
@@ -0,0 +1,210 @@
+import atexit
+import hashlib
+import os
+import threading
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+KINDS = ("temporary", "permanent")
+
+
+class KeyStore:
+    """
+    Fingerprints of the public keys of the patients, kept in memory.
+
+    Keys are written to disk by a background thread, so that generating them does not wait for the files. The same
+    thread polls the modification time of the public keys, so that keys changed by another process are picked up.
+    Checking a key is a dictionary lookup and does not touch the disk unless the key does not match.
+    """
+
+    def __init__(self, private_dir="../private_keys", public_dir="../public_keys", poll_interval=1.0):
+        """
+        Parameters
+        ----------
+        private_dir : str
+            Folder of the private keys.
+        public_dir : str
+            Folder of the public keys.
+        poll_interval : float
+            Seconds between two checks of the modification time of the public keys.
+        """
+        self.private_dir = private_dir
+        self.public_dir = public_dir
+        self.poll_interval = poll_interval
+        # Fingerprints of the public keys of each patient, by kind of key
+        self.fingerprints = {}
+        # Modification time of each public key file when it was last read or written
+        self.mtimes = {}
+        # Contents of the files waiting to be written, by path
+        self.pending = {}
+        self.error = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def private_path(self, name, kind):
+        return os.path.join(self.private_dir, f"{name}_{kind}.pem")
+
+    def public_path(self, name, kind):
+        return os.path.join(self.public_dir, f"{name}_public_{kind[:4]}.pem")
+
+    @staticmethod
+    def fingerprint(public_key):
+        """
+        Return the SHA-256 digest of a public key.
+
+        Parameters
+        ----------
+        public_key : _RSAPublicKey
+
+        Returns
+        -------
+        fingerprint : bytes
+        """
+        return hashlib.sha256(public_key.public_bytes(encoding=serialization.Encoding.DER,
+                                                      format=serialization.PublicFormat.SubjectPublicKeyInfo)).digest()
+
+    def add(self, name, private_key, permanent=False):
+        """
+        Store the keys of a patient. The fingerprint is available straight away, the files are written in background.
+
+        Parameters
+        ----------
+        name : str
+            Name of the patient.
+        private_key : _RSAPrivateKey
+        permanent : bool
+            If True, the keys are stored as permanent keys, otherwise as temporary keys.
+        """
+        kind = "permanent" if permanent else "temporary"
+        public_key = private_key.public_key()
+        private_bytes = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                  format=serialization.PrivateFormat.PKCS8,
+                                                  encryption_algorithm=serialization.NoEncryption())
+        public_bytes = public_key.public_bytes(encoding=serialization.Encoding.PEM,
+                                               format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        with self._lock:
+            self.fingerprints.setdefault(name, {})[kind] = self.fingerprint(public_key)
+            self.pending[self.private_path(name, kind)] = private_bytes
+            self.pending[self.public_path(name, kind)] = public_bytes
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="keystore", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def check(self, name, key):
+        """
+        Check whether a private key matches the temporary or the permanent public key of a patient.
+
+        Parameters
+        ----------
+        name : str
+            Name of the patient.
+        key : _RSAPrivateKey
+
+        Returns
+        -------
+        bool
+        """
+        fingerprint = self.fingerprint(key.public_key())
+        if fingerprint in self.fingerprints.get(name, {}).values():
+            return True
+        # The keys may have been changed by another process since the last poll
+        self.reload(name)
+        return fingerprint in self.fingerprints.get(name, {}).values()
+
+    def reload(self, name):
+        """
+        Read again the public keys of a patient whose files were modified, created or deleted.
+
+        Parameters
+        ----------
+        name : str
+            Name of the patient.
+        """
+        for kind in KINDS:
+            path = self.public_path(name, kind)
+            with self._lock:
+                if path in self.pending:
+                    continue
+                known = self.mtimes.get(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if mtime == known:
+                    continue
+                with open(path, "rb") as key_file:
+                    public_key = serialization.load_pem_public_key(key_file.read(), backend=default_backend())
+            except FileNotFoundError:
+                if known is not None:
+                    with self._lock:
+                        if path not in self.pending:
+                            self.fingerprints.get(name, {}).pop(kind, None)
+                            self.mtimes.pop(path, None)
+                continue
+            except ValueError:
+                # The file is being written
+                continue
+            fingerprint = self.fingerprint(public_key)
+            with self._lock:
+                if path not in self.pending:
+                    self.fingerprints.setdefault(name, {})[kind] = fingerprint
+                    self.mtimes[path] = mtime
+
+    def poll(self):
+        """
+        Reload the public keys modified by other processes.
+        """
+        with self._lock:
+            names = list(self.fingerprints)
+        for name in names:
+            self.reload(name)
+
+    def flush(self):
+        """
+        Write the pending keys to disk.
+
+        Raises
+        ------
+        OSError
+            If a key could not be written, here or in background.
+        """
+        self._write()
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _write(self):
+        with self._write_lock:
+            with self._lock:
+                pending = list(self.pending.items())
+            for path, data in pending:
+                try:
+                    with open(path + ".tmp", "wb") as f:
+                        f.write(data)
+                    os.replace(path + ".tmp", path)
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError as e:
+                    with self._lock:
+                        if self.pending.get(path) is data:
+                            del self.pending[path]
+                    self.error = e
+                    continue
+                with self._lock:
+                    # Keep the file pending if a newer key was added meanwhile
+                    if self.pending.get(path) is data:
+                        del self.pending[path]
+                        self.mtimes[path] = mtime
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            self._write()
+            self.poll()
+
+
+# Keys of the patients of this process
+keys = KeyStore()
@@ -2,9 +2,10 @@ import datetime
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
 
-from blockchain import BlockChain, Block
+from blockchain import BlockChain, Block, ChainStore
+from registry import registry as default_registry
+from keystore import keys
 
 
 class IncompatibilityError(Exception):
@@ -18,13 +19,16 @@ class Patient(BlockChain):
     Patient object.
     """
 
-    def __init__(self, name, *args, **kw):
+    def __init__(self, name, registry=None, *args, **kw):
         super(BlockChain, self).__init__(*args, **kw)
         self.name = name
         self.player = "patient"
-        self.blocks = [self.get_genesis_block()]
+        self.blocks = ChainStore([self.get_genesis_block()])
+        # Names of the events in the chain, updated on every append
+        self.seen_events = set()
         self.generate_keys(permanent=True)
         self.generate_keys(permanent=False)
+        (registry or default_registry).register(self)
 
     def add_block(self, event, doctor):
         """
@@ -37,18 +41,51 @@ class Patient(BlockChain):
         doctor : Doctor
             BlockChain relative to the doctor that adds the event to the chain of the patient.
         """
-        # Prevent from adding prescriptions that are not compatible with previous diseases
+        self.check_event(event)
+        self.blocks.append(self.new_block(event, doctor))
+        self.seen_events.add(event.name)
+
+        verified, message = self.verify()
+        if not verified:
+            print(f"WARNING: {message}")
+
+    def check_event(self, event, staged=()):
+        """
+        Prevent from adding prescriptions that are not compatible with previous diseases.
+
+        Parameters
+        ----------
+        event : Event
+            BlockChain relative to the event to be added.
+        staged : set
+            Names of the events about to be added to the chain before `event`.
+
+        Raises
+        ------
+        IncompatibilityError
+            If the event is not compatible with a previous one.
+        """
         if event.event == "prescription":
-            for ev in self.get_chain().Kind:
-                if ev in event.incompatibilities:
+            for ev in event.incompatibilities:
+                if ev in self.seen_events or ev in staged:
                     raise IncompatibilityError(f"Past event {ev} is not compatible with {event.name} {event.event}")
 
-        self.blocks.append(Block(len(self.blocks), player=self.player, name=self.name, doctor=doctor.name,
-                                 timestamp=datetime.datetime.utcnow(), kind=event.event, data=event.name,
-                                 previous_hash=self.blocks[len(self.blocks) - 1].hash))
+    def new_block(self, event, doctor, timestamp=None):
+        """
+        Return the block that follows the last one of the chain, without appending it.
 
-        if not self.verify()[0]:
-            print(f"WARNING: {self.verify()[1]}")
+        Parameters
+        ----------
+        event : Event
+            BlockChain relative to the event that the patient faced.
+        doctor : Doctor
+            BlockChain relative to the doctor that adds the event to the chain of the patient.
+        timestamp : datetime.datetime, default None
+            Timestamp of the block. If None, the current time.
+        """
+        return Block(len(self.blocks), player=self.player, name=self.name, doctor=doctor.name,
+                     timestamp=timestamp or datetime.datetime.utcnow(), kind=event.event, data=event.name,
+                     previous_hash=self.blocks.hash(len(self.blocks) - 1))
 
     def generate_keys(self, permanent=False):
         """
@@ -67,22 +104,4 @@ class Patient(BlockChain):
             key_size=2048,
             backend=default_backend()
         )
-        public_key = private_key.public_key()
-
-        private_key = private_key.private_bytes(encoding=serialization.Encoding.PEM,
-                                                format=serialization.PrivateFormat.PKCS8,
-                                                encryption_algorithm=serialization.NoEncryption())
-        public_key = public_key.public_bytes(encoding=serialization.Encoding.PEM,
-                                             format=serialization.PublicFormat.SubjectPublicKeyInfo)
-
-        # Store keys
-        if not permanent:
-            with open(f'../private_keys/{self.name}_temporary.pem', 'wb') as f:
-                f.write(private_key)
-            with open(f'../public_keys/{self.name}_public_temp.pem', 'wb') as f:
-                f.write(public_key)
-        else:
-            with open(f'../private_keys/{self.name}_permanent.pem', 'wb') as f:
-                f.write(private_key)
-            with open(f'../public_keys/{self.name}_public_perm.pem', 'wb') as f:
-                f.write(public_key)
+        keys.add(self.name, private_key, permanent=permanent)
@@ -0,0 +1,88 @@
+PLAYERS = ("patient", "doctor", "event")
+
+
+class Registry:
+    """
+    Patients, doctors and events indexed by player and name.
+
+    Incompatibilities between events are resolved in both directions when an event is registered, including the
+    ones towards events that are registered later.
+    """
+
+    def __init__(self):
+        self.players = {player: {} for player in PLAYERS}
+        # Names of the events declaring an incompatibility with an event not registered yet, by name of the latter
+        self.unresolved = {}
+
+    def register(self, chain):
+        """
+        Add a BlockChain to the registry, replacing the one of the same player with the same name.
+
+        Parameters
+        ----------
+        chain : BlockChain
+            Patient, Doctor or Event to be registered.
+
+        Returns
+        -------
+        chain : BlockChain
+        """
+        self.players[chain.player][chain.name] = chain
+        if chain.player == "event":
+            events = self.players["event"]
+            for incompatibility in chain.incompatibilities:
+                if incompatibility in events:
+                    events[incompatibility].add_incompatibility(chain.name)
+                else:
+                    self.unresolved.setdefault(incompatibility, set()).add(chain.name)
+            for name in self.unresolved.pop(chain.name, ()):
+                chain.add_incompatibility(name)
+        return chain
+
+    def get(self, player, name):
+        """
+        Return the BlockChain of a player by name.
+
+        Parameters
+        ----------
+        player : str
+            Either "patient", "event" or "doctor".
+        name : str
+            Name of the BlockChain.
+
+        Raises
+        ------
+        KeyError
+            If no BlockChain of the player has that name.
+        """
+        return self.players[player][name]
+
+    def names(self, player):
+        """
+        Return the names of all the BlockChains of a player.
+
+        Parameters
+        ----------
+        player : str
+            Either "patient", "event" or "doctor".
+
+        Returns
+        -------
+        names : list
+        """
+        return list(self.players[player])
+
+    def count(self, player):
+        """
+        Count how many BlockChains the `player` has.
+
+        Parameters
+        ----------
+        player : str
+            Either "patient", "event" or "doctor".
+        """
+        return len(self.players[player])
+
+
+# Patients, doctors and events of this process
+registry = Registry()
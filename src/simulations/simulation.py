@@ -2,9 +2,6 @@ from patient import Patient
 from event import Event
 from doctor import Doctor
 
-l = locals()
-
-
 # --- PATIENTS --- #
 Ann = Patient("R945MU")
 Bob = Patient("C901UL")
@@ -19,30 +16,30 @@ Juliet = Patient("R462TV")
 
 
 # --- DISEASES --- #
-arthritis = Event("disease", "arthritis", loc=l)
-bulimia = Event("disease", "bulimia", loc=l)
-celiac = Event("disease", "celiac", loc=l)
-diabetes = Event("disease", "diabetes", loc=l)
-ebola = Event("disease", "ebola", loc=l)
-flatulence = Event("disease", "flatulence", loc=l)
-gastroenteritis = Event("disease", "gastroenteritis", loc=l)
-hemorrhoids = Event("disease", "hemorroids", loc=l)
-insomnia = Event("disease", "insomnia", loc=l)
-labyrinthitis = Event("disease", "labyrinthitis", loc=l)
+arthritis = Event("disease", "arthritis")
+bulimia = Event("disease", "bulimia")
+celiac = Event("disease", "celiac")
+diabetes = Event("disease", "diabetes")
+ebola = Event("disease", "ebola")
+flatulence = Event("disease", "flatulence")
+gastroenteritis = Event("disease", "gastroenteritis")
+hemorrhoids = Event("disease", "hemorroids")
+insomnia = Event("disease", "insomnia")
+labyrinthitis = Event("disease", "labyrinthitis")
 
 
 # --- PRESCRIPTIONS --- #
 """To avoid misinformation, prescriptions will not take real names."""
-prescription_1 = Event("prescription", "drug_1", loc=l, incompatibilities=None)
-prescription_2 = Event("prescription", "drug_2", loc=l, incompatibilities=["hemorroids"])
-prescription_3 = Event("prescription", "drug_3", loc=l, incompatibilities=["arthritis", "diabetes"])
-prescription_4 = Event("prescription", "drug_4", loc=l, incompatibilities=["bulimia", "ebola", "insomnia"])
-prescription_5 = Event("prescription", "drug_5", loc=l, incompatibilities=["arthritis", "ebola"])
-prescription_6 = Event("prescription", "drug_6", loc=l, incompatibilities=["gastroenteritis"])
-prescription_7 = Event("prescription", "drug_7", loc=l, incompatibilities=None)
-prescription_8 = Event("prescription", "drug_8", loc=l, incompatibilities=["diabetes"])
-prescription_9 = Event("prescription", "drug_9", loc=l, incompatibilities=["celiac", "insomnia"])
-prescription_10 = Event("prescription", "drug_10", loc=l, incompatibilities=["bulimia", "celiac", "diabetes"])
+prescription_1 = Event("prescription", "drug_1", incompatibilities=None)
+prescription_2 = Event("prescription", "drug_2", incompatibilities=["hemorroids"])
+prescription_3 = Event("prescription", "drug_3", incompatibilities=["arthritis", "diabetes"])
+prescription_4 = Event("prescription", "drug_4", incompatibilities=["bulimia", "ebola", "insomnia"])
+prescription_5 = Event("prescription", "drug_5", incompatibilities=["arthritis", "ebola"])
+prescription_6 = Event("prescription", "drug_6", incompatibilities=["gastroenteritis"])
+prescription_7 = Event("prescription", "drug_7", incompatibilities=None)
+prescription_8 = Event("prescription", "drug_8", incompatibilities=["diabetes"])
+prescription_9 = Event("prescription", "drug_9", incompatibilities=["celiac", "insomnia"])
+prescription_10 = Event("prescription", "drug_10", incompatibilities=["bulimia", "celiac", "diabetes"])
 
 
 # --- DOCTORS --- #
@@ -1,6 +1,7 @@
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 
+from keystore import keys
 from patient import Patient
 
 
@@ -71,15 +72,17 @@ def add_event(doctor, event, patient, key):
     refresh_keys(patient)
 
 
-def verify(chain):
+def verify(chain, full=False):
     """
     Verify data integrity of the BlockChain.
 
     Parameters
     ----------
     chain : BlockChain
+    full : bool, default False
+        If True, verify the whole chain instead of the blocks appended since the last verification.
     """
-    return chain.verify()
+    return chain.verify(full)
 
 
 def get_chain_size(chain):
@@ -106,6 +109,8 @@ def load_private_key(key):
     -------
     private_key : _RSAPrivateKey
     """
+    # The latest keys may still be waiting to be written
+    keys.flush()
     with open(key, "rb") as key_file:
         private_key = serialization.load_pem_private_key(
             key_file.read(),
@@ -154,16 +159,7 @@ def check_keys(key, patient):
     """
     if key is None:
         raise AttributeError("Please insert a valid key.")
-    key = key.public_key()
-    key = key.public_bytes(encoding=serialization.Encoding.PEM,
-                           format=serialization.PublicFormat.SubjectPublicKeyInfo)
-    public_key = load_public_key(f'../public_keys/{patient.name}_public_temp.pem')
-    public_key = public_key.public_bytes(encoding=serialization.Encoding.PEM,
-                                         format=serialization.PublicFormat.SubjectPublicKeyInfo)
-    permanent_key = load_public_key(f'../public_keys/{patient.name}_public_perm.pem')
-    permanent_key = permanent_key.public_bytes(encoding=serialization.Encoding.PEM,
-                                               format=serialization.PublicFormat.SubjectPublicKeyInfo)
-    if key != public_key and key != permanent_key:
+    if not keys.check(patient.name, key):
         raise PermissionError("You do not have access to the BlockChain of this patient.")
 
 
@@ -1,9 +1,10 @@
-import timeit
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+from time import perf_counter
 import hashlib
 import nacl.encoding
 import nacl.signing
+from incompatibility import IncompatibilityTable
+from keypool import generate_key_pair, key_fingerprint
+from metrics import registry
 
 
 class Doctor:
@@ -23,7 +24,10 @@ class Patient:
         self.name = name
         self.address = self.get_address(name)
         self.illnesses = []
+        # (version of the incompatibility matrix, number of illnesses included, bitmask)
+        self.illness_mask = (None, 0, 0)
         self.private_key, self.public_key = self.generate_keys()
+        self._fingerprint = (None, None)
 
     def get_address(self, name):
         key = hashlib.sha256()
@@ -37,36 +41,67 @@ class Patient:
         -------
         The private and the public key
         """
-        # Generate keys
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-        public_key = private_key.public_key()
+        return generate_key_pair()
 
-        return private_key, public_key
+    @property
+    def fingerprint(self):
+        """
+        Fingerprint of the current public key, computed once per key
+        """
+        public_key, fingerprint = self._fingerprint
+        if public_key is not self.public_key:
+            fingerprint = key_fingerprint(self.public_key)
+            self._fingerprint = (self.public_key, fingerprint)
+        return fingerprint
 
-    def refresh_keys(self):
+    def refresh_keys(self, key_pool=None, metrics=None):
         """
         Refresh temporary keys of the patient.
         Parameters
         ----------
-        patient : an object Patient
+        key_pool : a KeyPool to take the new keys from. If None, the keys are generated on the spot.
+        metrics : the Metrics recording the refresh, usually those of the chain. By default, the shared registry.
         """
-        self.private_key, self.public_key = self.generate_keys()
-        print("Temporary keys have been refreshed. Old keys have been destroyed and will not work.")
+        metrics = metrics if metrics is not None else registry
+        with metrics.span('keys.refresh', pooled=key_pool is not None):
+            if key_pool is not None:
+                self.private_key, self.public_key = key_pool.take()
+            else:
+                self.private_key, self.public_key = self.generate_keys()
+        metrics.increment('keys.refreshed')
 
 
 class Minister:
-    def __init__(self, incompatibilities):
+    def __init__(self, incompatibilities, key=None):
+        """
+
+        Parameters
+        ----------
+        incompatibilities: dictionary mapping each medicine to the illnesses it is not compatible with
+        key: the SigningKey of the Minister, or its 32 bytes seed. If None, a new key is generated.
+        """
         self.name = 'Minister of Health'
         self.address = self.get_address(self.name)
-        self.minister_key = nacl.signing.SigningKey.generate()
+        if key is None:
+            key = nacl.signing.SigningKey.generate()
+        elif not isinstance(key, nacl.signing.SigningKey):
+            key = nacl.signing.SigningKey(bytes(key))
+        self.minister_key = key
         public_key = self.minister_key.verify_key
         self.public_key = public_key.encode(encoder=nacl.encoding.HexEncoder)
         self.incompatibilities = incompatibilities
 
+    @property
+    def incompatibilities(self):
+        """
+        IncompatibilityTable mapping each medicine to the illnesses it is not compatible with
+        """
+        return self._incompatibilities
+
+    @incompatibilities.setter
+    def incompatibilities(self, incompatibilities):
+        self._incompatibilities = IncompatibilityTable(incompatibilities)
+
     def get_address(self, name):
         key = hashlib.sha256()
         key.update(name.encode('utf-8'))
@@ -102,10 +137,10 @@ class Miner:
         -------
         The nounce and the related time to find it
         """
-        start = timeit.timeit()
+        start = perf_counter()
         last_block = self.blockchain.last_block
         last_proof = last_block['nounce']
         nounce = self.blockchain.proof_of_work(last_proof)
-        end = timeit.timeit()
+        end = perf_counter()
         total_time = end - start
         return nounce, total_time
@@ -0,0 +1,364 @@
+import glob
+import hashlib
+import json
+import multiprocessing as mp
+import os
+
+from encoding import BLOCK_HEADER, decode_header, decode_transaction, encode_block, iter_transactions
+from merkle import MerkleTree, leaf_hash
+from mining import next_target, retarget_due, valid_proof
+from storage import BlockStore
+from verification import AuthorizationVerifier
+
+CHECKPOINT_VERSION = 2
+# Number of blocks verified by a worker in a single task
+RANGE_SIZE = 10000
+
+GENESIS_PREVIOUS_HASH = format(1, '064x')
+
+_verifier = None
+_stores = {}
+
+
+class Checkpoint:
+    """
+    A verified prefix of the chain: the height and hash of its last block, and what the later
+    blocks are checked against: the targets and timestamps of the last blocks, the illnesses of each
+    patient and whether the last authorization of each doctor is valid
+    """
+
+    def __init__(self, height, block_hash, nounce, illnesses=None, authorized=None, headers=None):
+        """
+
+        Parameters
+        ----------
+        height: index of the last verified block
+        block_hash: hash of the last verified block
+        nounce: nounce of the last verified block, needed to check the proof of work of the next one
+        illnesses: dictionary mapping the address of each patient to the set of its illnesses
+        authorized: dictionary mapping the address of each doctor to True if its authorization is valid
+        headers: list of (index, target, timestamp) of the last blocks, needed to compute the target
+            of the next ones
+        """
+        self.height = height
+        self.block_hash = block_hash
+        self.nounce = nounce
+        self.illnesses = illnesses if illnesses is not None else {}
+        self.authorized = authorized if authorized is not None else {}
+        self.headers = headers if headers is not None else []
+
+    def to_dict(self):
+        return {
+            'version': CHECKPOINT_VERSION,
+            'height': self.height,
+            'hash': self.block_hash,
+            'nounce': self.nounce,
+            'illnesses': {address: sorted(illnesses) for address, illnesses in self.illnesses.items()},
+            'authorized': self.authorized,
+            'headers': [list(header) for header in self.headers],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data['version'] != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {data['version']}.")
+        return cls(data['height'], data['hash'], data['nounce'],
+                   {address: set(illnesses) for address, illnesses in data['illnesses'].items()},
+                   data['authorized'], [tuple(header) for header in data['headers']])
+
+
+def save_checkpoint(checkpoint, directory):
+    """
+    Writes a checkpoint, tagged with its height
+    Parameters
+    ----------
+    checkpoint: the Checkpoint
+    directory: folder containing the checkpoints, created if it does not exist
+
+    Returns
+    -------
+    The path of the checkpoint
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'checkpoint-{checkpoint.height:010d}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint.to_dict(), f)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_checkpoints(directory):
+    """
+    Loads the checkpoints of a folder, from the most recent to the oldest.
+    Checkpoints that cannot be read are skipped.
+    Parameters
+    ----------
+    directory: folder containing the checkpoints
+
+    Returns
+    -------
+    Generator of Checkpoint objects
+    """
+    for path in sorted(glob.glob(os.path.join(directory, 'checkpoint-*.json')), reverse=True):
+        try:
+            with open(path) as f:
+                yield Checkpoint.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            continue
+
+
+class AuditReport:
+    """
+    Outcome of the verification of the chain
+    """
+
+    def __init__(self, start, height):
+        """
+
+        Parameters
+        ----------
+        start: index of the first block verified, the blocks before it were covered by a checkpoint
+        height: index of the last block verified
+        """
+        self.start = start
+        self.height = height
+        self.errors = []
+        self.checkpoint = None
+
+    def error(self, index, reason):
+        self.errors.append({'index': index, 'reason': reason})
+
+    @property
+    def valid(self):
+        return not self.errors
+
+
+def _init_worker(public_key):
+    global _verifier
+    _verifier = AuthorizationVerifier(public_key)
+
+
+def _read_blocks(source, start, end):
+    if isinstance(source, str):
+        if source not in _stores:
+            _stores[source] = BlockStore(source)
+        store = _stores[source]
+        return [store.get(i) for i in range(start, end)]
+    return source
+
+
+def _check_targets(headers, start, retarget_interval, target_block_time, errors):
+    """
+    Checks that the blocks declare the target computed from the blocks before them
+    Parameters
+    ----------
+    headers: list of (index, target, timestamp) of consecutive blocks, (index, None, None) for the
+        blocks that could not be decoded
+    start: position in `headers` of the first block checked, the previous ones are only used to
+        compute the targets
+    retarget_interval: number of blocks after which the difficulty is adjusted
+    target_block_time: desired number of seconds between two blocks, None if the difficulty never changes
+    errors: list the (index, reason) pairs are appended to
+    """
+    for k in range(max(start, 1), len(headers)):
+        index, target, _ = headers[k]
+        parent = headers[k - 1]
+        if target is None or parent[1] is None:
+            continue
+        expected = parent[1]
+        if retarget_due(parent[0], retarget_interval, target_block_time):
+            if k - 1 - retarget_interval < 0 or headers[k - 1 - retarget_interval][2] is None:
+                continue
+            expected = next_target(parent[1], parent[2] - headers[k - 1 - retarget_interval][2], retarget_interval,
+                                   target_block_time)
+        if target != expected:
+            errors.append((index, 'Wrong target'))
+
+
+def _verify_range(task):
+    """
+    Verifies a range of consecutive blocks on their own: indexes, links, targets and proofs of work
+    between them, Merkle roots, encoding, duplicates and signatures of the authorizations.
+    The targets of the first `retarget_interval` + 1 blocks depend on the previous range and are left
+    to the caller.
+    Parameters
+    ----------
+    task: tuple (source, start, end, retarget_interval, target_block_time), where source is either
+        the folder of a BlockStore or the list of the encoded blocks from position start to end
+
+    Returns
+    -------
+    The tuple (first, last, errors, events, headers):
+    first: previous hash, nounce and target of the first block, to be linked to the previous range
+    last: hash and nounce of the last block
+    errors: list of (index, reason) pairs
+    events: list of (index, type, sender, recipient, payload) tuples, one for each transaction,
+        whose payload is True or False for the authorizations, depending on their signature
+    headers: the (index, target, timestamp) of the first and of the last `retarget_interval` + 1 blocks
+    """
+    source, start, end, retarget_interval, target_block_time = task
+    errors = []
+    events = []
+    authorizations = []
+    headers = []
+    first = last = None
+    for position, raw in enumerate(_read_blocks(source, start, end), start):
+        index = position + 1
+        try:
+            header = decode_header(raw)
+            transactions = [decode_transaction(transaction) for transaction in iter_transactions(raw)]
+        except (ValueError, IndexError, UnicodeDecodeError):
+            errors.append((index, 'Not valid encoding'))
+            headers.append((index, None, None))
+            continue
+        hash_ = hashlib.sha256(memoryview(raw)[:BLOCK_HEADER.size]).hexdigest()
+        headers.append((index, header['target'], header['timestamp']))
+
+        if header['index'] != index:
+            errors.append((index, 'Wrong block index'))
+        if last is None:
+            first = (header['previous_hash'], header['nounce'], header['target'])
+        else:
+            if header['previous_hash'] != last[0]:
+                errors.append((index, 'Wrong previous hash'))
+            if not valid_proof(last[1], header['nounce'], header['target']):
+                errors.append((index, 'Not valid proof of work'))
+        last = (hash_, header['nounce'])
+
+        tree = MerkleTree(leaf_hash(transaction) for transaction in iter_transactions(raw))
+        if tree.mutated or tree.root.hex() != header['merkle_root']:
+            errors.append((index, 'Wrong Merkle root'))
+        seen = set()
+        for transaction in iter_transactions(raw):
+            encoded = bytes(transaction)
+            if encoded in seen:
+                errors.append((index, 'Duplicated transaction'))
+            seen.add(encoded)
+
+        for transaction in transactions:
+            kind = transaction['type']
+            if kind == 'authorization':
+                authorizations.append((transaction['recipient'], transaction['authorization']))
+                payload = len(authorizations) - 1
+            else:
+                payload = transaction['illness' if kind == 'diagnosis' else 'prescription']
+            events.append((index, kind, transaction['sender'], transaction['recipient'], payload))
+
+    valid = _verifier.verify_many(authorizations)
+    for i, event in enumerate(events):
+        if event[1] == 'authorization':
+            is_valid = valid[event[4]]
+            if not is_valid:
+                errors.append((event[0], 'Not valid authorization'))
+            events[i] = event[:4] + (is_valid,)
+    _check_targets(headers, retarget_interval + 1, retarget_interval, target_block_time, errors)
+    return first, last, errors, events, (headers[:retarget_interval + 1], headers[-retarget_interval - 1:])
+
+
+def _apply(checkpoint, masks, matrix, block_events, report):
+    """
+    Checks the transactions of a block against the state before the block, then applies them
+    """
+    for index, kind, sender, recipient, payload in block_events:
+        if kind == 'authorization':
+            continue
+        if not checkpoint.authorized.get(sender, False):
+            report.error(index, 'Not valid Doctor authorization')
+        elif kind == 'prescription' and not matrix.is_compatible(payload, masks.get(recipient, 0)):
+            report.error(index, 'Incompatibility of one prescription with the history of the patient')
+    for index, kind, sender, recipient, payload in block_events:
+        if kind == 'authorization':
+            checkpoint.authorized[recipient] = payload
+        elif kind == 'diagnosis':
+            checkpoint.illnesses.setdefault(recipient, set()).add(payload)
+            masks[recipient] = masks.get(recipient, 0) | matrix.illness_mask([payload])
+
+
+def verify_chain(chain, public_key, matrix, checkpoint=None, processes=None, range_size=RANGE_SIZE,
+                 target_block_time=None, retarget_interval=10):
+    """
+    Verifies the blocks of a chain after a checkpoint. The blocks are split in ranges verified
+    independently by a pool of processes; the ranges are then linked to each other and the
+    authorizations and prescriptions are checked in order against the state of the chain.
+    Parameters
+    ----------
+    chain: the list of blocks or the PersistentChain
+    public_key: the hex encoded public key of the Minister
+    matrix: the IncompatibilityMatrix the prescriptions are checked against
+    checkpoint: the Checkpoint of a verified prefix of the chain. If None, the whole chain is verified.
+    processes: number of processes, by default the number of CPUs
+    range_size: number of blocks verified by a process in a single task
+    target_block_time: desired number of seconds between two blocks, None if the difficulty never
+        changes. The target of the genesis block is trusted.
+    retarget_interval: number of blocks after which the difficulty is adjusted
+
+    Returns
+    -------
+    An AuditReport, whose checkpoint covers the whole chain if no error was found
+    """
+    state = checkpoint if checkpoint is not None else Checkpoint(0, None, None)
+    # Copies the state, so that a checkpoint is never modified
+    state = Checkpoint(state.height, state.block_hash, state.nounce,
+                       {address: set(illnesses) for address, illnesses in state.illnesses.items()},
+                       dict(state.authorized), list(state.headers))
+    masks = {address: matrix.illness_mask(illnesses) for address, illnesses in state.illnesses.items()}
+    height = len(chain)
+    report = AuditReport(state.height + 1, height)
+
+    processes = processes or os.cpu_count()
+    starts = range(state.height, height, range_size)
+    pool = None
+    if processes > 1 and len(starts) > 1:
+        pool = mp.get_context().Pool(min(processes, len(starts)), initializer=_init_worker, initargs=(public_key,))
+    else:
+        _init_worker(public_key)
+
+    def tasks():
+        directory = getattr(getattr(chain, 'store', None), 'directory', None)
+        for start in starts:
+            end = min(start + range_size, height)
+            if pool is not None and directory is not None:
+                # The workers read the blocks from the store themselves
+                yield directory, start, end, retarget_interval, target_block_time
+            elif directory is not None:
+                yield [chain.store.get(i) for i in range(start, end)], start, end, retarget_interval, target_block_time
+            else:
+                yield [encode_block(block) for block in chain[start:end]], start, end, retarget_interval, target_block_time
+
+    results = pool.imap(_verify_range, tasks()) if pool is not None else map(_verify_range, tasks())
+    try:
+        for first, last, errors, events, (head, tail) in results:
+            # The targets at the start of the range depend on the blocks of the previous range
+            headers = state.headers + head
+            _check_targets(headers, len(state.headers), retarget_interval, target_block_time, errors)
+            state.headers = (state.headers + tail)[-retarget_interval - 1:]
+            for index, reason in errors:
+                report.error(index, reason)
+            if first is not None:
+                # Links the range to the previous one
+                index = state.height + 1
+                if state.block_hash is None:
+                    if first[0] != GENESIS_PREVIOUS_HASH:
+                        report.error(index, 'Wrong previous hash')
+                else:
+                    if first[0] != state.block_hash:
+                        report.error(index, 'Wrong previous hash')
+                    if not valid_proof(state.nounce, first[1], first[2]):
+                        report.error(index, 'Not valid proof of work')
+            start = 0
+            for i in range(1, len(events) + 1):
+                if i == len(events) or events[i][0] != events[start][0]:
+                    _apply(state, masks, matrix, events[start:i], report)
+                    start = i
+            if last is not None:
+                state.block_hash, state.nounce = last
+            state.height = min(state.height + range_size, height)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    report.errors.sort(key=lambda error: error['index'])
+    if report.valid:
+        report.checkpoint = state
+    return report
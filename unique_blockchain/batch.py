@@ -0,0 +1,193 @@
+import numpy as np
+
+from encoding import ENCODING_VERSION, PAYLOAD_KEYS, TRANSACTION_HEADER, TYPE_CODES
+
+# Header of the encoded transactions as a NumPy record, the same layout as TRANSACTION_HEADER
+HEADER_DTYPE = np.dtype([('version', 'u1'), ('type', 'u1'), ('sender', 'V32'), ('recipient', 'V32'),
+                         ('fee', '>f8'), ('length', '>u2')])
+assert HEADER_DTYPE.itemsize == TRANSACTION_HEADER.size
+
+MAX_PAYLOAD = 2 ** 16 - 1
+
+# Value of each hex digit by code point, 255 for the other characters
+_HEX_VALUES = np.full(128, 255, dtype=np.uint8)
+for _digit in '0123456789abcdef':
+    _HEX_VALUES[ord(_digit)] = int(_digit, 16)
+    _HEX_VALUES[ord(_digit.upper())] = int(_digit, 16)
+
+
+def parse_addresses(addresses):
+    """
+    Converts a column of addresses to bytes
+    Parameters
+    ----------
+    addresses: array of 64 characters hex strings, of 32 bytes strings or of shape (n, 32) of uint8
+
+    Returns
+    -------
+    The array of shape (n, 32) of uint8 and the boolean array of the valid addresses
+    """
+    addresses = np.asarray(addresses)
+    if addresses.dtype == np.uint8 and addresses.ndim == 2 and addresses.shape[1] == 32:
+        return addresses, np.ones(len(addresses), dtype=bool)
+    if addresses.dtype.kind == 'S':
+        valid = np.char.str_len(addresses) == 32
+        raw = np.zeros((len(addresses), 32), dtype=np.uint8)
+        raw[valid] = np.frombuffer(addresses[valid].astype('S32').tobytes(), dtype=np.uint8).reshape(-1, 32)
+        return raw, valid
+    addresses = addresses.astype(str)
+    valid = np.char.str_len(addresses) == 64
+    # The code points of the digits, two per byte
+    points = np.ascontiguousarray(addresses.astype('U64')).view(np.uint32).reshape(len(addresses), 64)
+    digits = _HEX_VALUES[np.minimum(points, 127)]
+    valid &= (points < 128).all(axis=1) & (digits != 255).all(axis=1)
+    digits[~valid] = 0
+    return (digits[:, 0::2] << 4) | digits[:, 1::2], valid
+
+
+class TransactionBatch:
+    """
+    Transactions of the same type stored by columns. The encoded transactions are built for
+    the whole batch at once, and the dictionary of a transaction is only created when it
+    leaves the mempool to enter a block.
+    """
+
+    def __init__(self, kind, senders, recipients, codes, fees):
+        """
+
+        Parameters
+        ----------
+        kind: 'diagnosis' or 'prescription'
+        senders: array of shape (n, 32) of uint8, the addresses of the doctors
+        recipients: array of shape (n, 32) of uint8, the addresses of the patients
+        codes: array of the illnesses or the medicines, as strings
+        fees: array of the fees
+        """
+        self.kind = kind
+        self.senders = senders
+        self.recipients = recipients
+        self.codes = codes
+        self.fees = fees
+        self.payloads = np.char.encode(codes, 'utf-8')
+        self.sizes = TRANSACTION_HEADER.size + np.char.str_len(self.payloads).astype(np.int64)
+        self._encoded = None
+
+    def __len__(self):
+        return len(self.fees)
+
+    @property
+    def encoded(self):
+        """
+        The list of the encoded transactions, the same as `encode_transaction` of each row
+        """
+        if self._encoded is None:
+            headers = np.zeros(len(self), dtype=HEADER_DTYPE)
+            headers['version'] = ENCODING_VERSION
+            headers['type'] = TYPE_CODES[self.kind]
+            headers['sender'] = self.senders.view('V32').ravel()
+            headers['recipient'] = self.recipients.view('V32').ravel()
+            headers['fee'] = self.fees
+            headers['length'] = self.sizes - TRANSACTION_HEADER.size
+            raw = headers.tobytes()
+            size = TRANSACTION_HEADER.size
+            self._encoded = [raw[i * size:(i + 1) * size] + payload
+                             for i, payload in enumerate(self.payloads.tolist())]
+        return self._encoded
+
+    def transaction(self, row):
+        """
+        Builds the dictionary of a transaction of the batch, with the addresses as hex strings
+        """
+        return {
+            'type': self.kind,
+            'sender': self.senders[row].tobytes().hex(),
+            'recipient': self.recipients[row].tobytes().hex(),
+            PAYLOAD_KEYS[self.kind]: str(self.codes[row]),
+            'fee': float(self.fees[row])
+        }
+
+
+class BatchReport:
+    """
+    Outcome of the submission of a batch
+    """
+
+    def __init__(self, size):
+        # Reason of the rejection of each row, None for the accepted ones
+        self.rejections = np.full(size, None, dtype=object)
+
+    def reject(self, rows, reason):
+        """
+        Rejects the rows of a boolean mask that were not rejected yet
+        """
+        self.rejections[rows & self.accepted] = reason
+
+    @property
+    def accepted(self):
+        return np.equal(self.rejections, None)
+
+    def reasons(self):
+        """
+        Returns
+        -------
+        Dictionary counting the rejected rows for each reason
+        """
+        reasons, counts = np.unique(self.rejections[~self.accepted].astype(str), return_counts=True)
+        return dict(zip(reasons.tolist(), counts.tolist()))
+
+
+def validate_batch(blockchain, kind, senders, recipients, codes, fees):
+    """
+    Checks a batch with vectorized operations: the structure of each row, the authorization of
+    the doctors and, for prescriptions, the compatibility with the history of the patients
+    Parameters
+    ----------
+    blockchain: the Blockchain the batch is validated against
+    kind: 'diagnosis' or 'prescription'
+    senders: the addresses of the doctors, see `parse_addresses`
+    recipients: the addresses of the patients, see `parse_addresses`
+    codes: the illnesses or the medicines
+    fees: the fees
+
+    Returns
+    -------
+    The TransactionBatch and the BatchReport
+    """
+    if kind not in ('diagnosis', 'prescription'):
+        raise ValueError(f'Batches of {kind} transactions are not supported.')
+    fees = np.asarray(fees, dtype=np.float64)
+    codes = np.asarray(codes, dtype=str)
+    if not len(senders) == len(recipients) == len(codes) == len(fees):
+        raise ValueError('The columns of the batch must have the same length.')
+    senders, valid_senders = parse_addresses(senders)
+    recipients, valid_recipients = parse_addresses(recipients)
+    batch = TransactionBatch(kind, senders, recipients, codes, fees)
+    report = BatchReport(len(batch))
+
+    report.reject(~(valid_senders & valid_recipients), 'Not valid sender or recipient')
+    report.reject(~np.isfinite(fees) | (fees < 0), 'Not valid fee')
+    report.reject((np.char.str_len(codes) == 0) | (batch.sizes - TRANSACTION_HEADER.size > MAX_PAYLOAD),
+                  'Missing payload')
+
+    # Authorizations are checked once per doctor
+    doctors, inverse = np.unique(senders.view('V32').ravel(), return_inverse=True)
+    addresses = [doctor.tobytes().hex() for doctor in doctors]
+    authorizations = []
+    for address in addresses:
+        agent = blockchain.state.agents.get(address)
+        authorization = getattr(agent, 'authorization', None) if agent is not None else None
+        authorizations.append((address, authorization or blockchain.state.authorizations.get(address)))
+    authorized = np.array(blockchain.verifier.verify_many(authorizations), dtype=bool)
+    report.reject(~authorized[inverse.ravel()], 'Not valid Doctor authorization')
+
+    if kind == 'prescription':
+        # Illness masks are computed once per patient
+        matrix = blockchain.incompatibility_matrix
+        patients, inverse = np.unique(recipients.view('V32').ravel(), return_inverse=True)
+        masks = [matrix.illness_mask(blockchain.state.illnesses.get(patient.tobytes().hex(), ()))
+                 for patient in patients]
+        drugs, drug_inverse = np.unique(codes, return_inverse=True)
+        rows = np.array([matrix.drug_ids.get(drug, len(matrix.drug_ids)) for drug in drugs.tolist()], dtype=np.intp)
+        incompatible = (matrix.matrix[rows[drug_inverse.ravel()]] & matrix.unpack(masks)[inverse.ravel()]).any(axis=1)
+        report.reject(incompatible, 'Incompatibility of one prescription with the history of the patient')
+    return batch, report
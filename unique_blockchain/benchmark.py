@@ -0,0 +1,289 @@
+"""
+Benchmarks of the hot paths of the ledger. Results are written as JSON, so that the runs of
+two commits can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --baseline before.json --output after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter, time
+
+from agents import Doctor, Miner, Minister, Patient
+from blockchain import Blockchain
+from keypool import KeyPool
+
+BENCHMARKS = ('hash', 'proof_of_work', 'verify_authorizations', 'add_info', 'get_patient_history', 'mine')
+
+
+class Fixture:
+    """
+    A chain with authorized doctors, patients with a history of diagnoses and a table of
+    incompatibilities, all generated from a seed
+    """
+
+    def __init__(self, block_size=100, patients=50, doctors=10, medicines=100, illnesses=200,
+                 incompatibilities=3, history=5, difficulty=8, key_pool=0, seed=0):
+        """
+
+        Parameters
+        ----------
+        block_size: number of transactions in each block
+        patients: number of patients
+        doctors: number of doctors
+        medicines: number of medicines in the table of incompatibilities
+        illnesses: number of distinct illnesses
+        incompatibilities: number of illnesses each medicine is not compatible with
+        history: number of diagnoses of each patient before the benchmarks
+        difficulty: number of leading zero bits of the proof of work
+        key_pool: size of the KeyPool refreshing the keys of the patients, 0 to generate them on the spot
+        seed: seed of the generated data
+        """
+        self.rng = random.Random(seed)
+        self.block_size = block_size
+        self.illnesses = [f'illness{i}' for i in range(illnesses)]
+        self.medicines = [f'medicine{i}' for i in range(medicines)]
+        table = {medicine: self.rng.sample(self.illnesses, min(incompatibilities, illnesses))
+                 for medicine in self.medicines}
+        self.key_pool = KeyPool(key_pool) if key_pool else None
+        self.blockchain = Blockchain(Minister, table, difficulty=difficulty, key_pool=self.key_pool)
+        self.doctors = [Doctor(f'Doctor {i}') for i in range(doctors)]
+        self.patients = [Patient(f'Patient {i}') for i in range(patients)]
+        self.miners = [Miner(self.blockchain) for _ in range(2)]
+
+        for doctor in self.doctors:
+            self.blockchain.new_authorization(doctor, 1)
+        self.forge()
+        diagnoses = [(patient, self.rng.choice(self.illnesses)) for patient in self.patients for _ in range(history)]
+        for start in range(0, len(diagnoses), block_size):
+            for patient, illness in diagnoses[start:start + block_size]:
+                self.blockchain.new_diagnosis(self.rng.choice(self.doctors), patient, illness, self.fee())
+            self.forge()
+
+    def fee(self):
+        return round(self.rng.random(), 2)
+
+    def fill(self):
+        """
+        Adds a block worth of diagnoses and prescriptions to the mempool
+        """
+        for _ in range(self.block_size):
+            doctor, patient = self.rng.choice(self.doctors), self.rng.choice(self.patients)
+            if self.rng.random() < 0.5:
+                self.blockchain.new_diagnosis(doctor, patient, self.rng.choice(self.illnesses), self.fee())
+            else:
+                self.blockchain.new_prescription(doctor, patient, self.rng.choice(self.medicines), self.fee())
+
+    def forge(self):
+        """
+        Builds, validates and appends the next block
+        """
+        blockchain = self.blockchain
+        nounce = blockchain.proof_of_work(blockchain.last_block['nounce'])
+        blockchain.assemble_block()
+        blockchain.verify_authorizations()
+        block = blockchain.new_block(nounce)
+        blockchain.add_info(block)
+        return block
+
+    def close(self):
+        if self.key_pool is not None:
+            self.key_pool.close()
+
+
+def bench_hash(fixture):
+    loops = 1000
+    block = fixture.blockchain.last_block
+    start = perf_counter()
+    for _ in range(loops):
+        fixture.blockchain.hash(block)
+    return perf_counter() - start, loops
+
+
+def bench_proof_of_work(fixture):
+    # The number of hashes needed varies a lot from one proof to the other
+    loops = 20
+    last_proofs = [fixture.rng.getrandbits(32) for _ in range(loops)]
+    start = perf_counter()
+    for last_proof in last_proofs:
+        fixture.blockchain.proof_of_work(last_proof)
+    return perf_counter() - start, loops
+
+
+def bench_verify_authorizations(fixture):
+    blockchain = fixture.blockchain
+    fixture.fill()
+    blockchain.assemble_block()
+    count = len(blockchain.current_transactions)
+    start = perf_counter()
+    blockchain.verify_authorizations()
+    elapsed = perf_counter() - start
+    blockchain.add_info(blockchain.new_block(blockchain.proof_of_work(blockchain.last_block['nounce'])))
+    return elapsed, count
+
+
+def bench_add_info(fixture):
+    blockchain = fixture.blockchain
+    fixture.fill()
+    nounce = blockchain.proof_of_work(blockchain.last_block['nounce'])
+    blockchain.assemble_block()
+    blockchain.verify_authorizations()
+    block = blockchain.new_block(nounce)
+    start = perf_counter()
+    blockchain.add_info(block)
+    return perf_counter() - start, len(block['transactions'])
+
+
+def bench_get_patient_history(fixture):
+    patient = fixture.rng.choice(fixture.patients)
+    start = perf_counter()
+    fixture.blockchain.get_patient_history(patient, patient.private_key)
+    return perf_counter() - start, 1
+
+
+def bench_mine(fixture):
+    fixture.fill()
+    start = perf_counter()
+    fixture.blockchain.mine(fixture.miners)
+    return perf_counter() - start, len(fixture.blockchain.last_block['transactions'])
+
+
+def summarize(samples):
+    """
+    Summarizes the (seconds, operations) pairs of the repetitions of a benchmark
+    """
+    seconds = [elapsed for elapsed, _ in samples]
+    operations = sum(count for _, count in samples)
+    return {
+        'repeats': len(samples),
+        'min': min(seconds),
+        'median': median(seconds),
+        'mean': sum(seconds) / len(seconds),
+        'operations': operations,
+        'operations_per_second': operations / sum(seconds) if sum(seconds) else None,
+    }
+
+
+def run(benchmarks=BENCHMARKS, repeats=5, warmup=1, **parameters):
+    """
+    Runs the benchmarks on a fixture built from the parameters
+    Parameters
+    ----------
+    benchmarks: names of the benchmarks to run
+    repeats: number of timed repetitions of each benchmark
+    warmup: number of repetitions run before the timed ones
+    parameters: the parameters of the Fixture
+
+    Returns
+    -------
+    Dictionary with the environment, the parameters and the summary of each benchmark
+    """
+    results = {}
+    fixture = Fixture(**parameters)
+    try:
+        for name in benchmarks:
+            function = globals()[f'bench_{name}']
+            for _ in range(warmup):
+                function(fixture)
+            results[name] = summarize([function(fixture) for _ in range(repeats)])
+    finally:
+        fixture.close()
+    return {
+        'environment': environment(),
+        'parameters': dict(parameters, repeats=repeats, warmup=warmup),
+        'results': results,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares the median time of the benchmarks of two runs
+    Parameters
+    ----------
+    baseline: the results of the reference run
+    current: the results of the new run
+    threshold: relative slowdown above which a benchmark is a regression
+
+    Returns
+    -------
+    Dictionary mapping each benchmark of both runs to the ratio between its new and its reference
+    median, and the list of the regressions
+    """
+    ratios = {}
+    for name, result in current['results'].items():
+        if name in baseline['results']:
+            ratios[name] = result['median'] / baseline['results'][name]['median']
+    regressions = [name for name, ratio in ratios.items() if ratio > 1 + threshold]
+    return ratios, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', help=f"benchmarks to run among {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument('--block-size', type=int, default=100)
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--medicines', type=int, default=100, help='size of the table of incompatibilities')
+    parser.add_argument('--illnesses', type=int, default=200)
+    parser.add_argument('--incompatibilities', type=int, default=3,
+                        help='number of illnesses each medicine is not compatible with')
+    parser.add_argument('--history', type=int, default=5, help='number of diagnoses of each patient')
+    parser.add_argument('--difficulty', type=int, default=8)
+    parser.add_argument('--key-pool', type=int, default=0, help='size of the pool of patient keys, 0 for none')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--output', help='file where the results are written, standard output by default')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown of the median reported as a regression')
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run(args.benchmarks or BENCHMARKS, args.repeats, args.warmup, block_size=args.block_size,
+                  patients=args.patients, doctors=args.doctors, medicines=args.medicines,
+                  illnesses=args.illnesses, incompatibilities=args.incompatibilities, history=args.history,
+                  difficulty=args.difficulty, key_pool=args.key_pool, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratios, regressions = compare(baseline, results, args.threshold)
+        for name, ratio in ratios.items():
+            flag = '  REGRESSION' if name in regressions else ''
+            print(f'{name:<24}{ratio:8.2f}x{flag}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,131 @@
 import hashlib
-import json
+from collections import OrderedDict
 from time import time
-import nacl.encoding
-import nacl.signing
 import numpy as np
 from agents import Patient
-from cryptography.hazmat.primitives import serialization
+from audit import RANGE_SIZE, load_checkpoints, save_checkpoint, verify_chain
+from batch import validate_batch
+from encoding import decode_block, encode_header, encode_transaction
+from forkchoice import BlockTree
+from keypool import key_fingerprint
+from incompatibility import IncompatibilityMatrix
+from mempool import Mempool
+from merkle import MerkleTree, leaf_hash, verify_proof
+from metrics import registry
+from state import LedgerState, load_snapshots, save_snapshot
+from storage import BlockStore, PersistentChain, load_minister_key, save_minister_key
+from validation import ValidationPipeline
+from verification import AuthorizationVerifier
+from mining import DEFAULT_DIFFICULTY, DEFAULT_TARGET, MiningPool, difficulty_to_target, next_target, retarget_due, \
+    valid_proof
+
+# Number of Merkle trees kept in memory to build inclusion proofs
+MERKLE_CACHE_SIZE = 1024
+# Number of blocks below the tip that can still be replaced by a competing branch
+FORK_DEPTH = 1000
+# Upper bounds of the buckets of the histograms counting transactions
+BLOCK_SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
 
 
 class Blockchain(object):
-    def __init__(self, minister, incompatibilities):
-        self.current_transactions = []
-        self.chain = []
-
-        # Create the genesis block
-        self.new_block(previous_hash=1, nounce=100)
+    def __init__(self, minister, incompatibilities, difficulty=DEFAULT_DIFFICULTY, target_block_time=None,
+                 retarget_interval=10, mempool=None, validator=None, store=None, snapshots=None,
+                 snapshot_interval=1000, key_pool=None, checkpoints=None, metrics=None):
+        """
 
-        self.Minister = minister(incompatibilities)
+        Parameters
+        ----------
+        minister: the class Minister, or the Minister of a chain being reopened. When the class is given
+            and the store holds the key of a Minister, the Minister is created with that key.
+        incompatibilities: dictionary mapping each medicine to the illnesses it is not compatible with
+        difficulty: number of leading zero bits required to the proof of work hash
+        target_block_time: desired number of seconds between two blocks. If None, the difficulty never changes.
+        retarget_interval: number of blocks after which the difficulty is adjusted
+        mempool: the Mempool holding the pending transactions. By default, a Mempool without limits.
+        validator: the ValidationPipeline checking the transactions before they enter a block
+        store: folder of a BlockStore where the chain is persisted, with the key of the Minister.
+            If the folder already contains blocks, the chain is reopened. If None, the chain is only
+            kept in memory.
+        snapshots: folder where snapshots of the state are saved and loaded from when the chain is reopened
+        snapshot_interval: number of blocks between two snapshots. Only the most recent snapshots are
+            kept, and each one is written while the block is added.
+        key_pool: the KeyPool providing the new keys of the patients after each access to their history.
+            If None, new keys are generated on the spot.
+        checkpoints: folder where the checkpoints of the verified chain are saved and loaded from.
+            If None, only the last checkpoint is kept in memory.
+        metrics: the Metrics recording the activity of the chain. By default, the shared registry.
+        """
+        if isinstance(minister, type):
+            minister = minister(incompatibilities, None if store is None else load_minister_key(store))
+        elif incompatibilities is not None:
+            minister.incompatibilities = incompatibilities
+        self.Minister = minister
+        self.verifier = AuthorizationVerifier(self.Minister.public_key)
+        self._incompatibility_matrix = None
+        self._incompatibility_version = None
+
+        self.key_pool = key_pool
+        self.metrics = metrics if metrics is not None else registry
+        self.mempool = mempool if mempool is not None else Mempool()
+        self.validator = validator if validator is not None else ValidationPipeline()
+        self.current_transactions = []
+        self.merkle_tree = MerkleTree()
+        self.merkle_trees = OrderedDict()
+        self.chain = [] if store is None else PersistentChain(BlockStore(store))
+        self.mining_pool = None
+        self.target = difficulty_to_target(difficulty)
+        self.target_block_time = target_block_time
+        self.retarget_interval = retarget_interval
+        self.snapshots = snapshots
+        self.snapshot_interval = snapshot_interval
+        self.state = LedgerState()
+        self.checkpoints = checkpoints
+        self.checkpoint = None
+        self.tree = None
+        # Blocks known to the tree but not on the main chain, by hash
+        self.side_blocks = {}
+
+        if store is not None:
+            self._check_minister(store)
+        if self.chain:
+            self.target = self.last_block['target']
+            self.retarget()
+            self.restore_state()
+            base = max(len(self.chain) - FORK_DEPTH, 1)
+            self.tree = BlockTree(self.chain[base - 1], self.hash(self.chain[base - 1]), target_block_time,
+                                  retarget_interval, self._ancestor)
+            for block in self.chain[base:]:
+                self.tree.set_tip(self.tree.add_header(block, self.hash(block)).hash)
+        else:
+            # Create the genesis block
+            genesis = self.new_block(previous_hash=format(1, '064x'), nounce=100)
+            self.state.apply_block(genesis, self.hash(genesis))
+            self.tree = BlockTree(genesis, self.hash(genesis), target_block_time, retarget_interval, self._ancestor)
+
+    def _check_minister(self, store):
+        """
+        Checks that the Minister is the one who signed the authorizations of a persisted chain, and
+        saves its key with the store if it is not there yet
+        Raises
+        ------
+        ValueError
+            If the chain was signed by another Minister.
+        """
+        seed = load_minister_key(store)
+        if seed is not None:
+            if self.Minister.minister_key.encode() != seed:
+                raise ValueError(f'The Minister is not the one of the chain stored in {store}.')
+            return
+        # Stores written before the key was saved: check the first authorization of the chain
+        for block in self.chain:
+            for transaction in block['transactions']:
+                if transaction['type'] == 'authorization':
+                    recipient = getattr(transaction['recipient'], 'address', transaction['recipient'])
+                    if not self.verifier.is_valid(recipient, transaction['authorization']):
+                        raise ValueError(f'The Minister is not the one of the chain stored in {store}.')
+                    save_minister_key(store, self.Minister)
+                    return
+        save_minister_key(store, self.Minister)
 
     def new_block(self, nounce, previous_hash=None):
         """
@@ -34,16 +143,161 @@ class Blockchain(object):
             'index': len(self.chain) + 1,
             'timestamp': time(),
             'transactions': self.current_transactions,
+            'merkle_root': self.merkle_tree.root.hex(),
             'nounce': nounce,
+            'target': self.target,
             'previous_hash': previous_hash or self.hash(self.chain[-1]),
         }
 
+        if self.tree is not None:
+            # Checks the proof of work before the block enters the chain
+            self.tree.set_tip(self.tree.add_header(block, self.hash(block)).hash)
+            self._prune()
+
         # Reset the current list of transactions
+        self.cache_merkle_tree(block['index'], self.merkle_tree)
         self.current_transactions = []
+        self.merkle_tree = MerkleTree()
 
         self.chain.append(block)
+        self.retarget()
         return block
 
+    def receive_block(self, block):
+        """
+        Adds a block mined by another node. The chain follows the branch with the most accumulated
+        work: if the block makes a competing branch heavier than the main chain, the blocks after
+        the fork are disconnected and the blocks of the branch are validated and connected.
+        Parameters
+        ----------
+        block: the dictionary representing the block, or the encoded block
+
+        Returns
+        -------
+        True if the block is on the main chain once received
+
+        Raises
+        ------
+        UnknownParentError
+            If the previous block is unknown, the caller should first provide the missing blocks.
+        ValueError
+            If the proof of work or the Merkle root of the block are not valid.
+        """
+        if isinstance(block, (bytes, bytearray, memoryview)):
+            block = decode_block(block)
+        hash_ = self.hash(block)
+        if hash_ not in self.tree:
+            tree = MerkleTree(self.transaction_hash(t) for t in block['transactions'])
+            if tree.mutated or tree.root.hex() != block['merkle_root']:
+                raise ValueError(f'Not valid Merkle root at block {hash_}.')
+            self.tree.add_header(block, hash_)
+            self.side_blocks[hash_] = block
+            if self.tree.best is not self.tree.tip:
+                self.switch_to(self.tree.best.hash)
+        return self.tree.on_main_chain(hash_)
+
+    def switch_to(self, hash_):
+        """
+        Reorganizes the chain so that it ends with the block specified. Transactions of the
+        disconnected blocks go back to the mempool. If a block of the new branch contains an
+        invalid transaction, the branch is dropped from the tree and the chain switches to the
+        heaviest remaining branch. The dropped blocks are not banned and can be received again.
+        Parameters
+        ----------
+        hash_: hash of the new tip, its branch must be stored in `side_blocks`
+        """
+        disconnect, connect = self.tree.path(self.tree.tip.hash, hash_)
+        if disconnect:
+            self.metrics.increment('reorganizations')
+            self.metrics.increment('blocks.disconnected', len(disconnect))
+            fork = disconnect[-1].height - 1
+            for node in disconnect:
+                self.side_blocks[node.hash] = self.chain[node.height - 1]
+            self.tree.set_tip(disconnect[-1].parent.hash)
+            self._truncate(fork)
+            for node in reversed(disconnect):
+                for transaction in self.side_blocks[node.hash]['transactions']:
+                    self.mempool.add(transaction)
+
+        for node in connect:
+            block = self.side_blocks[node.hash]
+            report = self.validator.run(self, block['transactions'])
+            if report.rejected:
+                self.metrics.increment('blocks.invalid')
+                # The header does not commit to these transactions: the block may still be received
+                # again with its own ones
+                self.tree.remove(node.hash)
+                self._forget()
+                break
+            del self.side_blocks[node.hash]
+            self.chain.append(block)
+            self.add_info(block)
+            self.tree.set_tip(node.hash)
+            self.mempool.remove(block['transactions'])
+
+        self.target = self.last_block['target']
+        self.retarget()
+        if self.tree.best is not self.tree.tip:
+            self.switch_to(self.tree.best.hash)
+        self._prune()
+
+    def _truncate(self, height):
+        """
+        Drops the blocks after `height` and undoes their transactions in the state. If they cannot
+        be undone, the state of the remaining chain is rebuilt.
+        """
+        removed = [self.chain[i] for i in range(len(self.chain) - 1, height - 1, -1)]
+        if isinstance(self.chain, list):
+            del self.chain[height:]
+        else:
+            self.chain.truncate(height)
+        for index in [index for index in self.merkle_trees if index > height]:
+            del self.merkle_trees[index]
+        try:
+            for block in removed:
+                for address in self.state.undo_block(block):
+                    self.verifier.invalidate(address)
+        except ValueError:
+            self.restore_state()
+
+    def _ancestor(self, height):
+        """
+        Returns the block of the main chain at `height`, used by the tree for the blocks below its base
+        """
+        return self.chain[height - 1]
+
+    def _prune(self):
+        if self.tree.tip.height - self.tree.base.height > 2 * FORK_DEPTH:
+            self.tree.prune(FORK_DEPTH)
+            self._forget()
+
+    def _forget(self):
+        """
+        Drops the side blocks that are no longer in the tree
+        """
+        for hash_ in [hash_ for hash_ in self.side_blocks if hash_ not in self.tree]:
+            del self.side_blocks[hash_]
+
+    def retarget(self):
+        """
+        Every `retarget_interval` blocks, adjusts the target so that the average time between the
+        last `retarget_interval` blocks gets back to `target_block_time`.
+        The adjustment is limited to a factor 4 in either direction.
+        """
+        if not retarget_due(len(self.chain), self.retarget_interval, self.target_block_time):
+            return
+        first = self.chain[-self.retarget_interval - 1]
+        last = self.chain[-1]
+        self.target = next_target(self.target, last['timestamp'] - first['timestamp'], self.retarget_interval,
+                                  self.target_block_time)
+
+    @property
+    def difficulty(self):
+        """
+        Number of leading zero bits currently required to the proof of work hash
+        """
+        return 256 - self.target.bit_length() + 1
+
     def new_diagnosis(self, sender, recipient, illness, fee):
         """
         Appends a transaction to the current transactions
@@ -58,7 +312,7 @@ class Blockchain(object):
         -------
         The index of the current block
         """
-        self.current_transactions.append({
+        self.add_transaction({
             'type': 'diagnosis',
             'sender': sender,
             'recipient': recipient,
@@ -80,7 +334,7 @@ class Blockchain(object):
         -------
         The index of the current block
         """
-        self.current_transactions.append({
+        self.add_transaction({
             'type': 'authorization',
             'sender': self.Minister,
             'recipient': recipient,
@@ -104,7 +358,7 @@ class Blockchain(object):
         -------
         The index of the current block
         """
-        self.current_transactions.append({
+        self.add_transaction({
             'type': 'prescription',
             'sender': sender,
             'recipient': recipient,
@@ -114,14 +368,77 @@ class Blockchain(object):
 
         return self.last_block['index'] + 1
 
+    def add_transaction(self, transaction):
+        """
+        Adds a transaction to the mempool
+        Parameters
+        ----------
+        transaction: the dictionary representing the transaction
+        """
+        self.mempool.add(transaction)
+
+    def submit_batch(self, kind, senders, recipients, codes, fees):
+        """
+        Adds many diagnoses or prescriptions to the mempool at once. The batch is given by columns
+        and validated with vectorized checks; the valid rows are written in the mempool in one step.
+        Parameters
+        ----------
+        kind: 'diagnosis' or 'prescription'
+        senders: the addresses of the doctors, as hex strings, 32 bytes strings or an array of
+            shape (n, 32) of uint8
+        recipients: the addresses of the patients, in the same formats as the senders
+        codes: the illnesses or the medicines
+        fees: the fees
+
+        Returns
+        -------
+        The BatchReport giving the reason of the rejection of each row, None for the accepted rows
+        """
+        with self.metrics.span('batch.submission', kind=kind):
+            batch, report = validate_batch(self, kind, senders, recipients, codes, fees)
+            accepted = report.accepted
+            added = self.mempool.add_batch(batch, np.flatnonzero(accepted))
+            duplicated = np.zeros(len(batch), dtype=bool)
+            duplicated[np.flatnonzero(accepted)[~added]] = True
+            report.reject(duplicated, 'Duplicated transaction')
+        self.metrics.increment('transactions.submitted', len(batch), kind=kind)
+        for reason, count in report.reasons().items():
+            self.metrics.increment('transactions.rejected', count, reason=reason)
+        return report
+
+    def assemble_block(self):
+        """
+        Moves the transactions with the highest fee that fit in a block from the mempool to the
+        current transactions, adding them to the Merkle tree of the next block
+        """
+        with self.metrics.span('block.assembly'):
+            for transaction in self.mempool.select():
+                self.current_transactions.append(transaction)
+                self.merkle_tree.append(self.transaction_hash(transaction))
+
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @staticmethod
+    def transaction_hash(transaction):
+        """
+        Hashes a transaction as a leaf of the Merkle tree of its block
+        Parameters
+        ----------
+        transaction: the dictionary representing the transaction
+
+        Returns
+        -------
+        The 32 bytes digest of the transaction
+        """
+        return leaf_hash(encode_transaction(transaction))
+
     @staticmethod
     def hash(block):
         """
-        Hashes the data contained in a block
+        Hashes the header of a block. The transactions are committed through the Merkle root,
+        so the cost does not depend on the size of the block.
         Parameters
         ----------
         block: the dictionary representing the block
@@ -130,10 +447,55 @@ class Blockchain(object):
         -------
         The resulting hash
         """
-        data = [str(transaction) for transaction in block['transactions']]
-        # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        block_string = json.dumps(data, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        return hashlib.sha256(encode_header(block)).hexdigest()
+
+    def get_merkle_tree(self, index):
+        """
+        Returns the Merkle tree of a block, rebuilding it from the transactions if it is not cached
+        Parameters
+        ----------
+        index: the index of the block
+        """
+        if index not in self.merkle_trees:
+            transactions = self.chain[index - 1]['transactions']
+            self.cache_merkle_tree(index, MerkleTree(self.transaction_hash(t) for t in transactions))
+        return self.merkle_trees[index]
+
+    def cache_merkle_tree(self, index, tree):
+        self.merkle_trees[index] = tree
+        if len(self.merkle_trees) > MERKLE_CACHE_SIZE:
+            self.merkle_trees.popitem(last=False)
+
+    def get_inclusion_proof(self, index, position):
+        """
+        Builds the proof that a transaction is included in a block
+        Parameters
+        ----------
+        index: the index of the block
+        position: the position of the transaction inside the block
+
+        Returns
+        -------
+        The transaction and the list of (side, hash) pairs leading to the Merkle root of the block
+        """
+        transaction = self.chain[index - 1]['transactions'][position]
+        return transaction, self.get_merkle_tree(index).proof(position)
+
+    @classmethod
+    def verify_inclusion(cls, transaction, proof, merkle_root):
+        """
+        Checks a single transaction against the Merkle root of a block, without the rest of the block
+        Parameters
+        ----------
+        transaction: the dictionary representing the transaction
+        proof: the proof returned by `get_inclusion_proof`
+        merkle_root: the Merkle root stored in the header of the block
+
+        Returns
+        -------
+        True if the transaction is included in the block, False otherwise
+        """
+        return verify_proof(cls.transaction_hash(transaction), proof, bytes.fromhex(merkle_root))
 
     def proof_of_work(self, last_proof):
         """
@@ -147,65 +509,46 @@ class Blockchain(object):
         The nounce solving the proof of work
         """
         nounce = 0
-        while self.valid_proof(last_proof, nounce) is False:
+        while self.valid_proof(last_proof, nounce, self.target) is False:
             nounce += 1
 
         return nounce
 
     @staticmethod
-    def valid_proof(last_proof, nounce):
-        guess = f'{last_proof}{nounce}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:2] == "00"
+    def valid_proof(last_proof, nounce, target=DEFAULT_TARGET):
+        return valid_proof(last_proof, nounce, target)
+
+    @property
+    def incompatibility_matrix(self):
+        """
+        The incompatibilities of the Minister compiled into an IncompatibilityMatrix.
+        It is compiled again only when the version of the incompatibilities of the Minister changes.
+        """
+        version = self.Minister.incompatibilities.version
+        if self._incompatibility_matrix is None or self._incompatibility_version != version:
+            self._incompatibility_matrix = IncompatibilityMatrix(self.Minister.incompatibilities)
+            self._incompatibility_version = version
+        return self._incompatibility_matrix
 
     def verify_authorizations(self):
         """
-        Verifies that doctor has a valid authorization to make diagnoses or prescriptions.
+        Verifies that doctor has a valid authorization to make diagnoses or prescriptions, and that
+        prescriptions are compatible with the history of the patient, running the current transactions
+        through the validation pipeline.
         If a transaction is invalid is removed by the list of current transactions.
         Returns
         -------
-
+        The ValidationReport listing the rejected transactions and the reasons
         """
-        c = 0
-        to_be_deleted = []
-        for transaction in self.current_transactions:
-            if transaction['type'] == 'authorization':
-                try:
-                    authorization = transaction['authorization']
-                    public_key = self.Minister.public_key
-                    public_key = nacl.signing.VerifyKey(public_key, encoder=nacl.encoding.HexEncoder)
-                    public_key.verify(authorization)
-
-                except:
-                    to_be_deleted.append(c)
-
-            else:
-                try:
-                    authorization = transaction['sender'].authorization
-                    public_key = self.Minister.public_key
-                    public_key = nacl.signing.VerifyKey(public_key, encoder=nacl.encoding.HexEncoder)
-                    public_key.verify(authorization)
-
-                except:
-                    to_be_deleted.append(c)
-                    print('Not valid Doctor authorization')
-                if transaction['type'] == 'prescription':
-                    try:
-                        incompatibilites = self.Minister.incompatibilities
-                        if transaction['prescription'] in incompatibilites.keys():
-                            prescription = transaction['prescription']
-                            illnesses_inc = set(self.Minister.incompatibilities[prescription])
-                            illnesses_patient = set(transaction['recipient'].illnesses)
-                            assert len(illnesses_inc.intersection(illnesses_patient)) == 0
-                    except:
-                        to_be_deleted.append(c)
-                        print('Incompatibility of one prescription with the history of the patient')
-            c += 1
-        new_transactions = []
-        for i in range(len(self.current_transactions)):
-            if i not in to_be_deleted:
-                new_transactions.append(self.current_transactions[i])
-        self.current_transactions = new_transactions
+        with self.metrics.span('validation'):
+            report = self.validator.run(self, self.current_transactions)
+            if report.rejected:
+                self.current_transactions = report.accepted
+                self.merkle_tree = MerkleTree(self.transaction_hash(t) for t in self.current_transactions)
+        self.metrics.increment('transactions.validated', len(report.transactions))
+        for reason, count in report.reasons().items():
+            self.metrics.increment('transactions.rejected', count, reason=reason)
+        return report
 
     def add_info(self, block):
         """
@@ -219,18 +562,88 @@ class Blockchain(object):
         -------
 
         """
-        transactions = block['transactions']
-        for transaction in transactions:
-            if transaction['type'] == 'diagnosis':
-                recipient = transaction['recipient']
-                illness = transaction['illness']
-                recipient.illnesses.append(illness)
-            if transaction['type'] == 'authorization':
-                recipient = transaction['recipient']
-                authorization = transaction['authorization']
-                recipient.authorization = authorization
+        for address in self.state.apply_block(block, self.hash(block)):
+            self.verifier.invalidate(address)
+
+        matrix = self.incompatibility_matrix
+        for transaction in block['transactions']:
+            if transaction['type'] == 'diagnosis' and not isinstance(transaction['recipient'], str):
+                matrix.patient_mask(transaction['recipient'])
 
-    def mine(self, miners):
+        if self.snapshots is not None and block['index'] % self.snapshot_interval == 0:
+            # Written synchronously, so the latency of this block includes the snapshot
+            with self.metrics.span('snapshot'):
+                save_snapshot(self.state, self.snapshots)
+
+    def register(self, agent):
+        """
+        Binds a Patient or a Doctor to the state of the chain, so that its illnesses or its
+        authorization reflect the blocks, also when the chain was reopened from a store
+        Parameters
+        ----------
+        agent: an object Patient or Doctor
+        """
+        self.state.register(agent)
+
+    def restore_state(self):
+        """
+        Rebuilds the state from the latest snapshot matching the chain, replaying only the blocks
+        after it. Without a valid snapshot, all the blocks are replayed.
+        The agents registered to the previous state are registered to the new one.
+        """
+        agents = self.state.agents
+        state = None
+        if self.snapshots is not None:
+            for snapshot in load_snapshots(self.snapshots):
+                if 0 < snapshot.height <= len(self.chain) and \
+                        self.hash(self.chain[snapshot.height - 1]) == snapshot.block_hash:
+                    state = snapshot
+                    break
+        self.state = state if state is not None else LedgerState()
+        self.state.rebind(agents)
+        for i in range(self.state.height, len(self.chain)):
+            block = self.chain[i]
+            self.state.apply_block(block, self.hash(block))
+
+    def latest_checkpoint(self):
+        """
+        Returns the most recent checkpoint matching the chain, None if there is none
+        """
+        candidates = [self.checkpoint] if self.checkpoint is not None else []
+        if self.checkpoints is not None:
+            candidates.extend(load_checkpoints(self.checkpoints))
+        for checkpoint in sorted(candidates, key=lambda checkpoint: checkpoint.height, reverse=True):
+            if 0 < checkpoint.height <= len(self.chain) and \
+                    self.hash(self.chain[checkpoint.height - 1]) == checkpoint.block_hash:
+                return checkpoint
+        return None
+
+    def verify_chain(self, full=False, processes=None, range_size=RANGE_SIZE):
+        """
+        Verifies the chain: links between the blocks, targets and proofs of work, Merkle roots, signatures of the
+        authorizations, authorization of the doctors and compatibility of the prescriptions.
+        Only the blocks after the latest checkpoint are verified, split in ranges checked in parallel.
+        If the chain is valid, a new checkpoint is recorded at its last block.
+        Parameters
+        ----------
+        full: if True, the checkpoints are ignored and the whole chain is verified
+        processes: number of processes verifying the ranges, by default the number of CPUs
+        range_size: number of blocks in each range
+
+        Returns
+        -------
+        The AuditReport listing the errors found, by block index
+        """
+        checkpoint = None if full else self.latest_checkpoint()
+        report = verify_chain(self.chain, self.Minister.public_key, self.incompatibility_matrix, checkpoint,
+                              processes, range_size, self.target_block_time, self.retarget_interval)
+        if report.valid and report.height >= report.start:
+            self.checkpoint = report.checkpoint
+            if self.checkpoints is not None:
+                save_checkpoint(report.checkpoint, self.checkpoints)
+        return report
+
+    def mine(self, miners, parallel=False):
         """
         Let each miner specified in the parameter "miners" perform the proof of work.
         As soon as a block is found, the chain is broadcasted to all the miners and the fees are
@@ -238,38 +651,74 @@ class Blockchain(object):
         Parameters
         ----------
         miners: list of objects "Miner"
+        parallel: if True, the miners race on separate shares of the nounce space in a pool of
+            processes and the first one finding a valid nounce wins. Otherwise each miner performs
+            the whole proof of work one after the other.
 
         Returns
         -------
+        The block mined
+        """
+        with self.metrics.span('mining'):
+            with self.metrics.span('mining.proof_of_work', parallel=bool(parallel)):
+                if parallel:
+                    if self.mining_pool is None:
+                        self.mining_pool = MiningPool()
+                    index_min, nounce, winning_time = self.mining_pool.race(self.last_block['nounce'], len(miners),
+                                                                            self.target)
+                else:
+                    times = []
+                    nounces = []
+                    for miner in miners:
+                        nounce, total_time = miner.mine_block()
+                        times.append(total_time)
+                        nounces.append(nounce)
+                    index_min = np.argmin(np.array(times))
+                    nounce = nounces[index_min]
+                    winning_time = times[index_min]
+            self.metrics.observe('mining.winner.seconds', winning_time)
+
+            # Forge the new Block by adding it to the chain
+            last_block = self.last_block
+            previous_hash = self.hash(last_block)
+            self.assemble_block()
+            self.verify_authorizations()
+            block = self.new_block(nounce, previous_hash)
+            self.add_info(block)
+
+            # Adding fees
+            fees = [transaction['fee'] for transaction in block['transactions']]
+            winning_miner = miners[index_min]
+            winning_miner.wallet = round(winning_miner.wallet + sum(fees), 2)
+
+            # Broadcasting
+            with self.metrics.span('broadcast'):
+                for miner in miners:
+                    miner.chain = self.chain
+
+        self.metrics.increment('blocks.mined')
+        self.metrics.increment('transactions.mined', len(block['transactions']))
+        self.metrics.increment('fees.paid', sum(fees))
+        self.metrics.observe('block.transactions', len(block['transactions']), buckets=BLOCK_SIZE_BUCKETS)
+        self.metrics.observe('mempool.depth', len(self.mempool), buckets=BLOCK_SIZE_BUCKETS)
+        return block
 
+    def close(self):
+        """
+        Terminates the pool of processes of the parallel mining, if any, and closes the files of
+        the chain when it is persisted
         """
-        times = []
-        nounces = []
-        for miner in miners:
-            nounce, total_time = miner.mine_block()
-            times.append(total_time)
-            nounces.append(nounce)
-        index_min = np.argmin(np.array(times))
-        nounce = nounces[index_min]
-
-        # Forge the new Block by adding it to the chain
-        last_block = self.last_block
-        previous_hash = self.hash(last_block)
-        self.verify_authorizations()
-        block = self.new_block(nounce, previous_hash)
-        self.add_info(block)
-        print('Mined a new block with number {0}'.format(block['index']))
-
-        # Adding fees
-        last_block = self.last_block
-        fees = [transaction['fee'] for transaction in last_block['transactions']]
-        winning_miner = miners[index_min]
-        winning_miner.wallet = round(winning_miner.wallet + sum(fees), 2)
-
-        # Broadcasting
-        for miner in miners:
-            miner.chain = self.chain
-        print('Block number {0} broadcasted to all the nodes'.format(last_block['index']))
+        if self.mining_pool is not None:
+            self.mining_pool.close()
+            self.mining_pool = None
+        if isinstance(self.chain, PersistentChain):
+            self.chain.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
 
     def check_keys(self, Patient, private_key):
         """
@@ -287,15 +736,7 @@ class Blockchain(object):
         """
         if private_key is None:
             raise AttributeError("Please insert a valid key.")
-        public_key_temp = private_key.public_key()
-        public_key_temp = public_key_temp.public_bytes(encoding=serialization.Encoding.PEM,
-                               format=serialization.PublicFormat.SubjectPublicKeyInfo)
-
-        public_key = Patient.public_key
-        public_key = public_key.public_bytes(encoding=serialization.Encoding.PEM,
-                                             format=serialization.PublicFormat.SubjectPublicKeyInfo)
-
-        if public_key_temp != public_key:
+        if key_fingerprint(private_key.public_key()) != Patient.fingerprint:
             raise PermissionError("You do not have access to the BlockChain of this patient.")
 
     def get_patient_history(self, patient, private_key):
@@ -313,7 +754,44 @@ class Blockchain(object):
         assert isinstance(patient, Patient)
         try:
             self.check_keys(patient, private_key)
-            patient.refresh_keys()
+            patient.refresh_keys(self.key_pool, self.metrics)
             return patient.illnesses
         except:
             raise PermissionError("You do not have access to the BlockChain of this patient.")
+
+    def query_patient_history(self, patient, private_key, start=None, end=None, kinds=None, cursor=None,
+                              limit=50):
+        """
+        Gets a page of the history of the patient specified, read from the chain, using a private key
+        specified by the patient.
+        Parameters
+        ----------
+        patient: an object "Patient"
+        private_key: the private key specified by the patient
+        start: if specified, only the records with a timestamp greater or equal to this
+        end: if specified, only the records with a timestamp lower or equal to this
+        kinds: if specified, only the records of these types, 'diagnosis' or 'prescription'
+        cursor: the cursor returned with the previous page, None for the first page
+        limit: maximum number of records in the page
+
+        Returns
+        -------
+        The list of records and the cursor of the next page, None if this is the last page.
+        Each record is a dictionary with the block index, the position in the block, the timestamp,
+        the type, the illness or medicine and the address of the doctor.
+        """
+        self.get_patient_history(patient, private_key)
+        entries, cursor = self.state.history.query(patient.address, start, end, kinds, cursor, limit)
+        records = []
+        for index, position, timestamp, kind in entries:
+            transaction = self.chain[index - 1]['transactions'][position]
+            sender = transaction['sender']
+            records.append({
+                'block': index,
+                'position': position,
+                'timestamp': timestamp,
+                'type': kind,
+                'code': transaction['illness' if kind == 'diagnosis' else 'prescription'],
+                'doctor': getattr(sender, 'address', sender),
+            })
+        return records, cursor
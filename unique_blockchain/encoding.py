@@ -0,0 +1,176 @@
+"""
+Canonical binary encoding of transactions and blocks.
+
+Every field has a fixed width, except the payload of a transaction which is length-prefixed,
+and the agents are identified by the 32 bytes of their address. The same bytes are used for
+hashing, persistence and network transfer, so that every process computes the same hashes.
+
+Transaction, version 1:
+    version (B) | type (B) | sender (32s) | recipient (32s) | fee (d) | payload length (H) | payload
+
+Block, version 1:
+    version (B) | index (Q) | timestamp (d) | nounce (Q) | target (32s) | merkle root (32s)
+    | previous hash (32s) | number of transactions (I) | [transaction length (I) | transaction] ...
+"""
+import struct
+
+ENCODING_VERSION = 1
+
+TRANSACTION_HEADER = struct.Struct('>BB32s32sdH')
+BLOCK_HEADER = struct.Struct('>BQdQ32s32s32s')
+LENGTH = struct.Struct('>I')
+
+TRANSACTION_TYPES = ('diagnosis', 'authorization', 'prescription')
+TYPE_CODES = {kind: code for code, kind in enumerate(TRANSACTION_TYPES)}
+# Key of the transaction dictionary holding the payload of each type
+PAYLOAD_KEYS = {'diagnosis': 'illness', 'authorization': 'authorization', 'prescription': 'prescription'}
+
+
+def address_bytes(party):
+    """
+    Returns the 32 bytes address of an agent, given either the agent itself or its hex address
+    """
+    return bytes.fromhex(getattr(party, 'address', party))
+
+
+def encode_transaction(transaction):
+    """
+    Encodes a transaction
+    Parameters
+    ----------
+    transaction: the dictionary representing the transaction. Sender and recipient can be
+        either agents or hex addresses.
+
+    Returns
+    -------
+    The encoded transaction
+    """
+    kind = transaction['type']
+    payload = transaction[PAYLOAD_KEYS[kind]]
+    payload = bytes(payload) if kind == 'authorization' else payload.encode('utf-8')
+    header = TRANSACTION_HEADER.pack(ENCODING_VERSION, TYPE_CODES[kind], address_bytes(transaction['sender']),
+                                     address_bytes(transaction['recipient']), transaction['fee'], len(payload))
+    return header + payload
+
+
+def decode_transaction(buffer, offset=0):
+    """
+    Decodes a transaction
+    Parameters
+    ----------
+    buffer: bytes-like object containing the encoded transaction
+    offset: position of the transaction inside the buffer
+
+    Returns
+    -------
+    The dictionary representing the transaction, where sender and recipient are hex addresses
+    """
+    version, code, sender, recipient, fee, length = TRANSACTION_HEADER.unpack_from(buffer, offset)
+    if version != ENCODING_VERSION:
+        raise ValueError(f'Unsupported transaction encoding version {version}.')
+    kind = TRANSACTION_TYPES[code]
+    start = offset + TRANSACTION_HEADER.size
+    payload = bytes(memoryview(buffer)[start:start + length])
+    return {
+        'type': kind,
+        'sender': sender.hex(),
+        'recipient': recipient.hex(),
+        PAYLOAD_KEYS[kind]: payload if kind == 'authorization' else payload.decode('utf-8'),
+        'fee': fee
+    }
+
+
+def encode_header(block):
+    """
+    Encodes the header of a block, that is everything but the transactions
+    Parameters
+    ----------
+    block: the dictionary representing the block
+
+    Returns
+    -------
+    The encoded header
+    """
+    return BLOCK_HEADER.pack(ENCODING_VERSION, block['index'], block['timestamp'], block['nounce'],
+                             block['target'].to_bytes(32, 'big'), bytes.fromhex(block['merkle_root']),
+                             bytes.fromhex(block['previous_hash']))
+
+
+def encode_block(block):
+    """
+    Encodes a whole block
+    Parameters
+    ----------
+    block: the dictionary representing the block
+
+    Returns
+    -------
+    The encoded block
+    """
+    parts = [encode_header(block), LENGTH.pack(len(block['transactions']))]
+    for transaction in block['transactions']:
+        encoded = encode_transaction(transaction)
+        parts.append(LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def iter_transactions(buffer):
+    """
+    Iterates over the encoded transactions of an encoded block without copying them
+    Parameters
+    ----------
+    buffer: bytes-like object containing the encoded block
+
+    Returns
+    -------
+    Generator of memoryview objects, one for each transaction
+    """
+    view = memoryview(buffer)
+    count = LENGTH.unpack_from(view, BLOCK_HEADER.size)[0]
+    offset = BLOCK_HEADER.size + LENGTH.size
+    for _ in range(count):
+        length = LENGTH.unpack_from(view, offset)[0]
+        offset += LENGTH.size
+        yield view[offset:offset + length]
+        offset += length
+
+
+def decode_header(buffer):
+    """
+    Decodes the header of an encoded block
+    Parameters
+    ----------
+    buffer: bytes-like object containing the encoded block
+
+    Returns
+    -------
+    The dictionary representing the block, without the transactions
+    """
+    version, index, timestamp, nounce, target, merkle_root, previous_hash = BLOCK_HEADER.unpack_from(buffer)
+    if version != ENCODING_VERSION:
+        raise ValueError(f'Unsupported block encoding version {version}.')
+    return {
+        'index': index,
+        'timestamp': timestamp,
+        'merkle_root': merkle_root.hex(),
+        'nounce': nounce,
+        'target': int.from_bytes(target, 'big'),
+        'previous_hash': previous_hash.hex(),
+    }
+
+
+def decode_block(buffer):
+    """
+    Decodes an encoded block
+    Parameters
+    ----------
+    buffer: bytes-like object containing the encoded block
+
+    Returns
+    -------
+    The dictionary representing the block, where agents are replaced by their hex addresses
+    """
+    block = decode_header(buffer)
+    block['transactions'] = [decode_transaction(transaction) for transaction in iter_transactions(buffer)]
+    return block
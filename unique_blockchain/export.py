@@ -0,0 +1,143 @@
+import hashlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from encoding import PAYLOAD_KEYS, decode_block, encode_header
+
+# Columns of the exported tables
+TRANSACTION_COLUMNS = ('block', 'timestamp', 'position', 'type', 'sender', 'recipient', 'code', 'fee')
+BLOCK_COLUMNS = ('index', 'timestamp', 'transactions', 'merkle_root', 'nounce', 'target', 'previous_hash', 'hash')
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('Exporting to Arrow or Parquet requires pyarrow, install it with `pip install pyarrow`.')
+
+
+def _address(party):
+    return getattr(party, 'address', party)
+
+
+def iter_blocks(chain):
+    """
+    Iterates over the blocks of a chain. The blocks of a PersistentChain are decoded straight
+    from its store, without going through its cache.
+    """
+    store = getattr(chain, 'store', None)
+    if store is None:
+        yield from chain
+    else:
+        for i in range(len(store)):
+            yield decode_block(store.get(i))
+
+
+def iter_columns(chain, table='transactions', batch_size=65536):
+    """
+    Iterates over the rows of a chain in batches of columns, built in a single pass over the blocks
+    Parameters
+    ----------
+    chain: the list of blocks or the PersistentChain
+    table: 'transactions' for one row per transaction, 'blocks' for one row per block
+    batch_size: maximum number of rows in each batch
+
+    Returns
+    -------
+    Generator of dictionaries mapping each column to the list of its values
+    """
+    if table not in ('transactions', 'blocks'):
+        raise ValueError(f'Unknown table {table}.')
+    names = TRANSACTION_COLUMNS if table == 'transactions' else BLOCK_COLUMNS
+    columns = {name: [] for name in names}
+    rows = 0
+    for block in iter_blocks(chain):
+        if table == 'blocks':
+            values = (block['index'], block['timestamp'], len(block['transactions']), block['merkle_root'],
+                      block['nounce'], format(block['target'], '064x'), block['previous_hash'],
+                      hashlib.sha256(encode_header(block)).hexdigest())
+            for name, value in zip(names, values):
+                columns[name].append(value)
+            rows += 1
+        else:
+            for position, transaction in enumerate(block['transactions']):
+                kind = transaction['type']
+                code = transaction[PAYLOAD_KEYS[kind]]
+                values = (block['index'], block['timestamp'], position, kind, _address(transaction['sender']),
+                          _address(transaction['recipient']), bytes(code).hex() if kind == 'authorization' else code,
+                          transaction['fee'])
+                for name, value in zip(names, values):
+                    columns[name].append(value)
+            rows += len(block['transactions'])
+        if rows >= batch_size:
+            yield columns
+            columns = {name: [] for name in names}
+            rows = 0
+    if rows:
+        yield columns
+
+
+def get_schema(table='transactions'):
+    """
+    Returns the Arrow schema of an exported table, 'transactions' or 'blocks'
+    """
+    _require_pyarrow()
+    if table == 'transactions':
+        return pa.schema([('block', pa.int64()), ('timestamp', pa.float64()), ('position', pa.int32()),
+                          ('type', pa.string()), ('sender', pa.string()), ('recipient', pa.string()),
+                          ('code', pa.string()), ('fee', pa.float64())])
+    return pa.schema([('index', pa.int64()), ('timestamp', pa.float64()), ('transactions', pa.int32()),
+                      ('merkle_root', pa.string()), ('nounce', pa.uint64()), ('target', pa.string()),
+                      ('previous_hash', pa.string()), ('hash', pa.string())])
+
+
+def iter_batches(chain, table='transactions', batch_size=65536):
+    """
+    Iterates over the rows of a chain as Arrow record batches
+    Parameters
+    ----------
+    chain: the list of blocks or the PersistentChain
+    table: 'transactions' or 'blocks'
+    batch_size: maximum number of rows in each batch
+
+    Returns
+    -------
+    Generator of pyarrow.RecordBatch
+    """
+    schema = get_schema(table)
+    for columns in iter_columns(chain, table, batch_size):
+        yield pa.record_batch([columns[name] for name in schema.names], schema=schema)
+
+
+def write_parquet(chain, path, table='transactions', batch_size=65536):
+    """
+    Writes a chain to a Parquet file, one row group per batch, without holding the whole table in memory
+    Parameters
+    ----------
+    chain: the list of blocks or the PersistentChain
+    path: the Parquet file
+    table: 'transactions' or 'blocks'
+    batch_size: maximum number of rows in each row group
+    """
+    _require_pyarrow()
+    with pq.ParquetWriter(path, get_schema(table)) as writer:
+        for batch in iter_batches(chain, table, batch_size):
+            writer.write_batch(batch)
+
+
+def write_arrow(chain, path, table='transactions', batch_size=65536):
+    """
+    Writes a chain to an Arrow IPC file, one record batch per batch
+    Parameters
+    ----------
+    chain: the list of blocks or the PersistentChain
+    path: the Arrow file
+    table: 'transactions' or 'blocks'
+    batch_size: maximum number of rows in each record batch
+    """
+    _require_pyarrow()
+    with pa.ipc.new_file(path, get_schema(table)) as writer:
+        for batch in iter_batches(chain, table, batch_size):
+            writer.write_batch(batch)
@@ -0,0 +1,263 @@
+from mining import next_target, retarget_due, valid_proof
+
+# Number of headers returned at most by `headers_after`
+MAX_HEADERS = 2000
+
+
+class UnknownParentError(Exception):
+    """Raised when a block does not extend any known block."""
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def block_work(target):
+    """
+    Expected number of hashes needed to meet a target
+    """
+    return (1 << 256) // (target + 1)
+
+
+class HeaderNode:
+    __slots__ = ('hash', 'header', 'parent', 'height', 'work')
+
+    def __init__(self, hash_, header, parent, height, work):
+        self.hash = hash_
+        self.header = header
+        self.parent = parent
+        self.height = height
+        self.work = work
+
+
+class BlockTree:
+    """
+    Tree of the known block headers, rooted at a base block. The tip is chosen as the header
+    with the most accumulated work; on a tie, the first one seen is kept.
+    The main chain, from the base to the tip, is kept as a list of hashes indexed by height.
+    """
+
+    def __init__(self, base, base_hash, target_block_time=None, retarget_interval=10, ancestor=None):
+        """
+
+        Parameters
+        ----------
+        base: the header of the oldest block of the tree, trusted without checks
+        base_hash: the hash of the base block
+        target_block_time: desired number of seconds between two blocks. If None, the difficulty never changes.
+        retarget_interval: number of blocks after which the difficulty is adjusted
+        ancestor: function returning the header of the main chain at a height below the base, needed
+            to retarget the first blocks after the base
+        """
+        self.target_block_time = target_block_time
+        self.retarget_interval = retarget_interval
+        self.ancestor = ancestor
+        node = HeaderNode(base_hash, base, None, base['index'], block_work(base['target']))
+        self.nodes = {base_hash: node}
+        self.base = node
+        self.best = node
+        self.tip = node
+        self.main_chain = [base_hash]
+        self.invalid = set()
+
+    def __contains__(self, hash_):
+        return hash_ in self.nodes
+
+    def expected_target(self, parent):
+        """
+        Returns the target that the block following `parent` must declare, the target of the parent
+        adjusted by the same rule as `Blockchain.retarget`
+        Parameters
+        ----------
+        parent: the HeaderNode of the previous block
+
+        Raises
+        ------
+        ValueError
+            If the blocks needed to retarget are not known.
+        """
+        target = parent.header['target']
+        if not retarget_due(parent.height, self.retarget_interval, self.target_block_time):
+            return target
+        height = parent.height - self.retarget_interval
+        first = parent
+        while first.height > height and first.parent is not None:
+            first = first.parent
+        if first.height == height:
+            first = first.header
+        elif self.ancestor is not None:
+            first = self.ancestor(height)
+        else:
+            raise ValueError(f'Block {height} is needed to retarget and is unknown.')
+        return next_target(target, parent.header['timestamp'] - first['timestamp'], self.retarget_interval,
+                           self.target_block_time)
+
+    def add_header(self, header, hash_):
+        """
+        Adds a header to the tree, checking that it extends a known block and declares the expected
+        target, with a valid proof of work
+        Parameters
+        ----------
+        header: the dictionary representing the block, transactions are not needed
+        hash_: the hash of the block
+
+        Returns
+        -------
+        The HeaderNode of the block
+
+        Raises
+        ------
+        UnknownParentError
+            If the previous block is not in the tree.
+        ValueError
+            If the header is not valid.
+        """
+        if hash_ in self.nodes:
+            return self.nodes[hash_]
+        if hash_ in self.invalid or header['previous_hash'] in self.invalid:
+            self.invalid.add(hash_)
+            raise ValueError(f'Block {hash_} extends an invalid block.')
+        parent = self.nodes.get(header['previous_hash'])
+        if parent is None:
+            raise UnknownParentError(f"Previous block {header['previous_hash']} is unknown.")
+        if header['index'] != parent.height + 1:
+            raise ValueError(f'Wrong block index at block {hash_}.')
+        target = self.expected_target(parent)
+        if header['target'] != target:
+            raise ValueError(f'Wrong target at block {hash_}.')
+        if not valid_proof(parent.header['nounce'], header['nounce'], target):
+            raise ValueError(f'Not valid proof of work at block {hash_}.')
+
+        node = HeaderNode(hash_, header, parent, parent.height + 1, parent.work + block_work(target))
+        self.nodes[hash_] = node
+        if node.work > self.best.work:
+            self.best = node
+        return node
+
+    def path(self, start, end):
+        """
+        Returns the blocks to disconnect and to connect to go from `start` to `end`
+        Parameters
+        ----------
+        start: hash of the current tip
+        end: hash of the new tip
+
+        Returns
+        -------
+        The list of the HeaderNode to disconnect, from `start` back to the common ancestor excluded,
+        and the list of the HeaderNode to connect, from the common ancestor excluded to `end`
+        """
+        old, new = self.nodes[start], self.nodes[end]
+        disconnect, connect = [], []
+        while old.height > new.height:
+            disconnect.append(old)
+            old = old.parent
+        while new.height > old.height:
+            connect.append(new)
+            new = new.parent
+        while old is not new:
+            disconnect.append(old)
+            connect.append(new)
+            old, new = old.parent, new.parent
+        connect.reverse()
+        return disconnect, connect
+
+    def set_tip(self, hash_):
+        """
+        Makes a block the tip of the main chain
+        """
+        disconnect, connect = self.path(self.tip.hash, hash_)
+        if disconnect:
+            del self.main_chain[-len(disconnect):]
+        self.main_chain.extend(node.hash for node in connect)
+        self.tip = self.nodes[hash_]
+
+    def mark_invalid(self, hash_):
+        """
+        Removes a block whose header is not valid and its descendants from the tree, so that they
+        are never chosen again
+        """
+        self.invalid |= self.remove(hash_)
+
+    def remove(self, hash_):
+        """
+        Removes a block and its descendants from the tree. They can be added again later, e.g.
+        when the block was received with transactions that do not belong to it.
+
+        Returns
+        -------
+        The set of the hashes removed
+        """
+        removed = {hash_}
+        # Parents are always added before their children
+        for node_hash, node in list(self.nodes.items()):
+            if node.parent is not None and node.parent.hash in removed:
+                removed.add(node_hash)
+        for node_hash in removed:
+            self.nodes.pop(node_hash, None)
+        if self.tip.hash in removed:
+            tip = self.tip
+            while tip.hash in removed:
+                tip = tip.parent
+            del self.main_chain[tip.height - self.base.height + 1:]
+            self.tip = tip
+        if self.best.hash in removed:
+            self.best = max(self.nodes.values(), key=lambda node: node.work)
+        return removed
+
+    def on_main_chain(self, hash_):
+        node = self.nodes.get(hash_)
+        return node is not None and node.height <= self.tip.height and \
+            self.main_chain[node.height - self.base.height] == hash_
+
+    def prune(self, depth):
+        """
+        Moves the base of the tree up to `depth` blocks below the tip, forgetting the older blocks
+        and the branches forking before the new base. Reorganizations deeper than `depth` become impossible.
+        """
+        height = self.tip.height - depth
+        if height <= self.base.height:
+            return
+        base = self.nodes[self.main_chain[height - self.base.height]]
+        del self.main_chain[:height - self.base.height]
+        kept = {base.hash: base}
+        # Parents are always added before their children
+        for node_hash, node in self.nodes.items():
+            if node.parent is not None and node.parent.hash in kept:
+                kept[node_hash] = node
+        base.parent = None
+        self.nodes = kept
+        self.base = base
+
+    def locator(self):
+        """
+        Returns the hashes describing the main chain to a peer: the last ten blocks, then blocks
+        exponentially further apart, and the base
+        """
+        hashes = []
+        step = 1
+        position = len(self.main_chain) - 1
+        while position > 0:
+            hashes.append(self.main_chain[position])
+            if len(hashes) >= 10:
+                step *= 2
+            position -= step
+        hashes.append(self.main_chain[0])
+        return hashes
+
+    def headers_after(self, locator, limit=MAX_HEADERS):
+        """
+        Returns the headers of the main chain following the first hash of the locator on the main chain
+        Parameters
+        ----------
+        locator: list of hashes, see `locator`
+        limit: maximum number of headers returned
+
+        Returns
+        -------
+        The list of HeaderNode
+        """
+        start = 0
+        for hash_ in locator:
+            if self.on_main_chain(hash_):
+                start = self.nodes[hash_].height - self.base.height + 1
+                break
+        return [self.nodes[hash_] for hash_ in self.main_chain[start:start + limit]]
@@ -0,0 +1,115 @@
+from bisect import bisect_left, bisect_right
+
+# Transactions recorded in the history of a patient
+HISTORY_TYPES = ('diagnosis', 'prescription')
+
+
+class HistoryIndex:
+    """
+    Index of the transactions concerning each patient. For each patient address it keeps, in chain
+    order, the (block index, position in the block, timestamp, type) of each diagnosis and prescription,
+    so that the records can be read back from the chain.
+
+    Block timestamps are not required to increase, so the timestamps of a patient are usually but
+    not always sorted. Their range is found by binary search when they are sorted, and by scanning
+    the entries of the patient otherwise.
+    """
+
+    def __init__(self, entries=None):
+        """
+
+        Parameters
+        ----------
+        entries: dictionary mapping each patient address to its list of entries
+        """
+        self.entries = {}
+        self.timestamps = {}
+        # Addresses of the patients whose timestamps are not sorted
+        self.unsorted = set()
+        for address, patient_entries in (entries or {}).items():
+            self.entries[address] = [tuple(entry) for entry in patient_entries]
+            self.timestamps[address] = [entry[2] for entry in patient_entries]
+            if not self._is_sorted(address):
+                self.unsorted.add(address)
+
+    def _is_sorted(self, address):
+        timestamps = self.timestamps[address]
+        return all(timestamps[i] <= timestamps[i + 1] for i in range(len(timestamps) - 1))
+
+    def add_block(self, block):
+        """
+        Indexes the transactions of a block
+        Parameters
+        ----------
+        block: the dictionary representing the block
+        """
+        for position, transaction in enumerate(block['transactions']):
+            if transaction['type'] not in HISTORY_TYPES:
+                continue
+            recipient = transaction['recipient']
+            address = getattr(recipient, 'address', recipient)
+            if address not in self.entries:
+                self.entries[address] = []
+                self.timestamps[address] = []
+            elif block['timestamp'] < self.timestamps[address][-1]:
+                self.unsorted.add(address)
+            self.entries[address].append((block['index'], position, block['timestamp'], transaction['type']))
+            self.timestamps[address].append(block['timestamp'])
+
+    def remove_block(self, block):
+        """
+        Removes the entries of a block, which must be the last block indexed
+        Parameters
+        ----------
+        block: the dictionary representing the block
+        """
+        for transaction in block['transactions']:
+            if transaction['type'] not in HISTORY_TYPES:
+                continue
+            recipient = transaction['recipient']
+            address = getattr(recipient, 'address', recipient)
+            entries = self.entries.get(address)
+            while entries and entries[-1][0] == block['index']:
+                entries.pop()
+                self.timestamps[address].pop()
+            if address in self.unsorted and self._is_sorted(address):
+                self.unsorted.discard(address)
+
+    def query(self, address, start=None, end=None, kinds=None, cursor=None, limit=50):
+        """
+        Returns a page of the history of a patient
+        Parameters
+        ----------
+        address: the address of the patient
+        start: if specified, only the entries with a timestamp greater or equal to this
+        end: if specified, only the entries with a timestamp lower or equal to this
+        kinds: if specified, only the entries of these types, e.g. ['prescription']
+        cursor: the cursor returned by the previous page, None for the first page
+        limit: maximum number of entries in the page
+
+        Returns
+        -------
+        The list of entries and the cursor of the next page, None if this is the last page
+        """
+        entries = self.entries.get(address, [])
+        timestamps = self.timestamps.get(address, [])
+        scan = address in self.unsorted
+        if scan:
+            first, last = 0, len(entries)
+        else:
+            first = bisect_left(timestamps, start) if start is not None else 0
+            last = bisect_right(timestamps, end) if end is not None else len(entries)
+        if cursor is not None:
+            first = max(first, cursor)
+
+        page = []
+        position = first
+        while position < last and len(page) < limit:
+            entry = entries[position]
+            if scan and ((start is not None and entry[2] < start) or (end is not None and entry[2] > end)):
+                position += 1
+                continue
+            if kinds is None or entry[3] in kinds:
+                page.append(entry)
+            position += 1
+        return page, (position if position < last else None)
@@ -0,0 +1,152 @@
+from itertools import count
+
+import numpy as np
+
+_versions = count()
+
+
+class IncompatibilityTable(dict):
+    """
+    Dictionary mapping each medicine to the illnesses it is not compatible with. Its version changes
+    whenever a medicine is set or removed, so that the compiled matrix is only rebuilt after a
+    change. The illnesses are stored as tuples, so that they cannot be changed in place.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def _changed(self):
+        self.version = next(_versions)
+
+    def __setitem__(self, medicine, illnesses):
+        super().__setitem__(medicine, tuple(illnesses))
+        self._changed()
+
+    def __delitem__(self, medicine):
+        super().__delitem__(medicine)
+        self._changed()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+
+    def setdefault(self, medicine, illnesses=()):
+        result = super().setdefault(medicine, tuple(illnesses))
+        self._changed()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update((medicine, tuple(illnesses)) for medicine, illnesses in dict(*args, **kwargs).items())
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+class IncompatibilityMatrix:
+    """
+    The incompatibilities of the Minister compiled once into integer codes. Each medicine is a
+    bitmask over the illness ids, so that checking a prescription against the history of a
+    patient is a single AND with the illness bitmask of the patient.
+    """
+
+    def __init__(self, incompatibilities):
+        """
+
+        Parameters
+        ----------
+        incompatibilities: dictionary mapping each medicine to the illnesses it is not compatible with
+        """
+        self.source = self.freeze(incompatibilities)
+        self.version = next(_versions)
+        self.illness_ids = {}
+        self.drug_ids = {}
+        self.drug_masks = {}
+        for drug, illnesses in self.source.items():
+            mask = 0
+            for illness in illnesses:
+                mask |= 1 << self.illness_ids.setdefault(illness, len(self.illness_ids))
+            self.drug_ids[drug] = len(self.drug_ids)
+            self.drug_masks[drug] = mask
+
+        # One row per medicine plus an empty row for the medicines without incompatibilities
+        self.matrix = np.zeros((len(self.drug_ids) + 1, len(self.illness_ids)), dtype=bool)
+        for drug, mask in self.drug_masks.items():
+            self.matrix[self.drug_ids[drug]] = self.unpack([mask])[0]
+
+    @staticmethod
+    def freeze(incompatibilities):
+        return {drug: tuple(illnesses) for drug, illnesses in incompatibilities.items()}
+
+    def illness_mask(self, illnesses):
+        """
+        Returns the bitmask of a list of illnesses. Illnesses that are not incompatible with any
+        medicine are ignored.
+        """
+        mask = 0
+        for illness in illnesses:
+            if illness in self.illness_ids:
+                mask |= 1 << self.illness_ids[illness]
+        return mask
+
+    def patient_mask(self, patient):
+        """
+        Returns the illness bitmask of a patient. The mask is stored in the patient as
+        (matrix version, number of illnesses seen, mask) and only the new illnesses are added to it.
+        """
+        version, seen, mask = patient.illness_mask
+        if version != self.version:
+            seen, mask = 0, 0
+        if seen < len(patient.illnesses):
+            mask |= self.illness_mask(patient.illnesses[seen:])
+            patient.illness_mask = (self.version, len(patient.illnesses), mask)
+        return mask
+
+    def is_compatible(self, drug, mask):
+        """
+        Checks a medicine against an illness bitmask
+        Parameters
+        ----------
+        drug: the medicine prescribed
+        mask: the illness bitmask of the patient
+
+        Returns
+        -------
+        True if the medicine is compatible with all the illnesses, False otherwise
+        """
+        return not self.drug_masks.get(drug, 0) & mask
+
+    def unpack(self, masks):
+        """
+        Converts a list of illness bitmasks into a boolean array with one row per mask
+        """
+        width = max((len(self.illness_ids) + 7) // 8, 1)
+        packed = np.frombuffer(b''.join(mask.to_bytes(width, 'little') for mask in masks), dtype=np.uint8)
+        bits = np.unpackbits(packed.reshape(len(masks), width), axis=1, bitorder='little')
+        return bits[:, :len(self.illness_ids)].astype(bool)
+
+    def compatible_many(self, drugs, masks):
+        """
+        Checks many prescriptions at once
+        Parameters
+        ----------
+        drugs: list of the medicines prescribed
+        masks: list of the illness bitmasks of the patients, one for each medicine
+
+        Returns
+        -------
+        Boolean numpy array, True where the medicine is compatible with the illnesses of the patient
+        """
+        if not drugs:
+            return np.ones(0, dtype=bool)
+        rows = np.fromiter((self.drug_ids.get(drug, len(self.drug_ids)) for drug in drugs),
+                           dtype=np.intp, count=len(drugs))
+        return ~(self.matrix[rows] & self.unpack(masks)).any(axis=1)
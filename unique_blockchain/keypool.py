@@ -0,0 +1,107 @@
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+def generate_key_pair():
+    """
+    Generates a private and the related public key
+    Returns
+    -------
+    The private and the public key
+    """
+    private_key = rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+        backend=default_backend()
+    )
+    return private_key, private_key.public_key()
+
+
+def key_fingerprint(public_key):
+    """
+    Returns the sha256 digest of the modulus and the exponent of a RSA public key
+    """
+    numbers = public_key.public_numbers()
+    modulus = numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, 'big')
+    return hashlib.sha256(modulus + numbers.e.to_bytes(4, 'big')).digest()
+
+
+def _generate_serialized(count):
+    """
+    Generates `count` private keys in a worker process. Keys are returned serialized since
+    they cannot be pickled.
+    """
+    return [generate_key_pair()[0].private_bytes(encoding=serialization.Encoding.DER,
+                                                 format=serialization.PrivateFormat.PKCS8,
+                                                 encryption_algorithm=serialization.NoEncryption())
+            for _ in range(count)]
+
+
+class KeyPool:
+    """
+    Pool of pre-generated RSA key pairs. Keys are generated in a worker process and the pool is
+    refilled in the background as soon as it drops below its low watermark.
+    """
+
+    def __init__(self, size=32, low_watermark=None, processes=1):
+        """
+
+        Parameters
+        ----------
+        size: number of key pairs the pool is refilled to
+        low_watermark: number of key pairs below which the pool is refilled. By default, half of `size`.
+        processes: number of worker processes generating the keys
+        """
+        self.size = size
+        self.low_watermark = low_watermark if low_watermark is not None else size // 2
+        self._keys = deque()
+        self._lock = threading.Lock()
+        self._pending = None
+        self._executor = ProcessPoolExecutor(max_workers=processes)
+        self.refill()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def refill(self):
+        """
+        Starts generating the missing key pairs, unless a refill is already running
+        """
+        with self._lock:
+            if self._pending is not None or len(self._keys) >= self.size:
+                return
+            self._pending = self._executor.submit(_generate_serialized, self.size - len(self._keys))
+        self._pending.add_done_callback(self._store)
+
+    def _store(self, future):
+        try:
+            keys = [serialization.load_der_private_key(key, password=None, backend=default_backend())
+                    for key in future.result()]
+        except Exception:
+            keys = []
+        with self._lock:
+            self._keys.extend((key, key.public_key()) for key in keys)
+            self._pending = None
+
+    def take(self):
+        """
+        Takes a key pair from the pool. If the pool is empty, the key pair is generated on the spot.
+        Returns
+        -------
+        The private and the public key
+        """
+        with self._lock:
+            pair = self._keys.popleft() if self._keys else None
+            low = len(self._keys) < self.low_watermark
+        if low:
+            self.refill()
+        return pair if pair is not None else generate_key_pair()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
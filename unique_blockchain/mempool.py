@@ -0,0 +1,221 @@
+import bisect
+import heapq
+from itertools import repeat
+
+import numpy as np
+
+from batch import TransactionBatch
+from encoding import encode_transaction
+
+# Consecutive transactions too large for the rest of a block after which the selection stops
+MAX_SKIPPED = 64
+
+
+class Mempool:
+    """
+    Pool of the transactions waiting to be included in a block, ordered by fee.
+    Transactions with the same fee are served in order of arrival. When the pool is full, the
+    transactions with the lowest fee are evicted.
+    """
+
+    def __init__(self, max_block_transactions=None, max_block_bytes=None, max_transactions=None, max_bytes=None):
+        """
+
+        Parameters
+        ----------
+        max_block_transactions: maximum number of transactions in a block
+        max_block_bytes: maximum size of the encoded transactions of a block
+        max_transactions: maximum number of transactions kept in the pool
+        max_bytes: maximum size of the encoded transactions kept in the pool
+        """
+        self.max_block_transactions = max_block_transactions
+        self.max_block_bytes = max_block_bytes
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.ids = {}
+        # First sequence number of each batch added, with [TransactionBatch, rows, rows still in the pool]
+        self._batch_starts = []
+        self._batches = []
+        self.bytes = 0
+        self.evicted = 0
+        self._sequence = 0
+        # Highest fee first, to build blocks
+        self._highest = []
+        # Lowest fee first, to evict transactions
+        self._lowest = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, transaction):
+        """
+        Adds a transaction to the pool, evicting the transactions with the lowest fee if it is full
+        Parameters
+        ----------
+        transaction: the dictionary representing the transaction
+
+        Returns
+        -------
+        True if the transaction is in the pool, False if it was evicted straight away
+        """
+        encoded = encode_transaction(transaction)
+        if encoded in self.ids:
+            return True
+        sequence = self._sequence
+        self._sequence += 1
+        size = len(encoded)
+        fee = transaction['fee']
+        self.entries[sequence] = (fee, size, transaction, encoded)
+        self.ids[encoded] = sequence
+        self.bytes += size
+        heapq.heappush(self._highest, (-fee, sequence))
+        heapq.heappush(self._lowest, (fee, -sequence))
+        while self._is_full():
+            self._evict()
+        return sequence in self.entries
+
+    def add_batch(self, batch, rows=None):
+        """
+        Adds the rows of a TransactionBatch to the pool at once. Their dictionaries are only built
+        when they are selected for a block.
+        Parameters
+        ----------
+        batch: the TransactionBatch
+        rows: array of the positions of the rows to add, all of them by default
+
+        Returns
+        -------
+        Boolean array, True for the rows added, False for the ones already in the pool
+        """
+        rows = np.arange(len(batch)) if rows is None else np.asarray(rows, dtype=np.intp)
+        encoded = batch.encoded
+        added = np.zeros(len(rows), dtype=bool)
+        new_rows = []
+        seen = set()
+        for i, row in enumerate(rows.tolist()):
+            if encoded[row] not in self.ids and encoded[row] not in seen:
+                seen.add(encoded[row])
+                new_rows.append(row)
+                added[i] = True
+
+        # Rows keep their order of arrival through consecutive sequence numbers
+        sequences = range(self._sequence, self._sequence + len(new_rows))
+        self._sequence += len(new_rows)
+        fees = batch.fees[new_rows].tolist()
+        sizes = batch.sizes[new_rows].tolist()
+        rows_encoded = [encoded[row] for row in new_rows]
+        self.entries.update(zip(sequences, zip(fees, sizes, repeat(batch), rows_encoded)))
+        self.ids.update(zip(rows_encoded, sequences))
+        if new_rows:
+            self._batch_starts.append(sequences.start)
+            self._batches.append([batch, new_rows, len(new_rows)])
+        self.bytes += sum(sizes)
+        self._highest.extend(zip([-fee for fee in fees], sequences))
+        heapq.heapify(self._highest)
+        self._lowest.extend(zip(fees, [-sequence for sequence in sequences]))
+        heapq.heapify(self._lowest)
+        while self._is_full():
+            self._evict()
+        return added
+
+    def _is_full(self):
+        if self.max_transactions is not None and len(self.entries) > self.max_transactions:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def _remove(self, sequence):
+        _, size, transaction, encoded = self.entries.pop(sequence)
+        del self.ids[encoded]
+        self.bytes -= size
+        if isinstance(transaction, TransactionBatch):
+            i = bisect.bisect_right(self._batch_starts, sequence) - 1
+            _, rows, _ = entry = self._batches[i]
+            entry[2] -= 1
+            transaction = transaction.transaction(rows[sequence - self._batch_starts[i]])
+        return transaction
+
+    def remove(self, transactions):
+        """
+        Removes from the pool the given transactions, e.g. because they were included in a block
+        received from another node
+        """
+        for transaction in transactions:
+            sequence = self.ids.get(encode_transaction(transaction))
+            if sequence is not None:
+                self._remove(sequence)
+        self._compact()
+
+    def _evict(self):
+        while True:
+            _, sequence = heapq.heappop(self._lowest)
+            if -sequence in self.entries:
+                self._remove(-sequence)
+                self.evicted += 1
+                return
+
+    def _compact(self):
+        """
+        Drops from the heaps the transactions that have already left the pool
+        """
+        if len(self._highest) > 2 * len(self.entries) + 64:
+            self._highest = [item for item in self._highest if item[1] in self.entries]
+            heapq.heapify(self._highest)
+        if len(self._lowest) > 2 * len(self.entries) + 64:
+            self._lowest = [item for item in self._lowest if -item[1] in self.entries]
+            heapq.heapify(self._lowest)
+        if any(entry[2] == 0 for entry in self._batches):
+            kept = [i for i, entry in enumerate(self._batches) if entry[2]]
+            self._batch_starts = [self._batch_starts[i] for i in kept]
+            self._batches = [self._batches[i] for i in kept]
+
+    def select(self):
+        """
+        Removes from the pool the transactions with the highest fee that fit in a block
+        Returns
+        -------
+        The list of transactions, from the highest to the lowest fee
+        """
+        transactions = []
+        skipped = []
+        size = 0
+        consecutive = 0
+        while self._highest and consecutive < MAX_SKIPPED:
+            if self.max_block_transactions is not None and len(transactions) >= self.max_block_transactions:
+                break
+            item = heapq.heappop(self._highest)
+            if item[1] not in self.entries:
+                continue
+            entry_size = self.entries[item[1]][1]
+            if self.max_block_bytes is not None and size + entry_size > self.max_block_bytes:
+                # Smaller transactions with a lower fee may still fit
+                skipped.append(item)
+                consecutive += 1
+                continue
+            consecutive = 0
+            size += entry_size
+            transactions.append(self._remove(item[1]))
+        for item in skipped:
+            heapq.heappush(self._highest, item)
+        self._compact()
+        return transactions
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dictionary with the number of transactions in the pool, their size, the number of evicted
+        transactions and the percentiles of the fees
+        """
+        fees = np.fromiter((entry[0] for entry in self.entries.values()), dtype=float, count=len(self.entries))
+        percentiles = [10, 25, 50, 75, 90]
+        if len(fees):
+            values = np.percentile(fees, percentiles).tolist()
+        else:
+            values = [None] * len(percentiles)
+        return {
+            'depth': len(self.entries),
+            'bytes': self.bytes,
+            'evicted': self.evicted,
+            'fee_percentiles': dict(zip(percentiles, values)),
+        }
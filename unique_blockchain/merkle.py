@@ -0,0 +1,133 @@
+import hashlib
+
+# Leaves and inner nodes are hashed with different prefixes, so that an inner node can never
+# be passed off as a leaf
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+EMPTY_ROOT = hashlib.sha256(b'').digest()
+
+
+def leaf_hash(data):
+    """
+    Hashes the serialized data of a leaf
+    Parameters
+    ----------
+    data: bytes-like object
+
+    Returns
+    -------
+    The 32 bytes digest of the leaf
+    """
+    return hashlib.sha256(LEAF_PREFIX + bytes(data)).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def verify_proof(leaf, proof, root):
+    """
+    Checks that a leaf belongs to the tree with the given root
+    Parameters
+    ----------
+    leaf: the leaf hash
+    proof: list of (side, hash) pairs as returned by MerkleTree.proof
+    root: the root of the tree
+
+    Returns
+    -------
+    True if the leaf is included in the tree, False otherwise
+    """
+    current = leaf
+    for side, sibling in proof:
+        if side == 'left':
+            current = node_hash(sibling, current)
+        else:
+            current = node_hash(current, sibling)
+    return current == root
+
+
+class MerkleTree:
+    """
+    Merkle tree built incrementally as leaves arrive. When a level has an odd number of nodes,
+    the last one is paired with itself. Each append and each proof cost O(log n).
+
+    Pairing the last node with itself means that repeating the last nodes of a level gives the
+    same root, e.g. for the leaves [a, b, c] and [a, b, c, c]. Such trees are `mutated` and must
+    be rejected, as no valid block contains the same transaction twice.
+    """
+
+    def __init__(self, leaves=()):
+        self.levels = [[]]
+        for leaf in leaves:
+            self.append(leaf)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def append(self, leaf):
+        """
+        Adds a leaf hash to the tree, updating only the path from the leaf to the root
+        Parameters
+        ----------
+        leaf: the leaf hash, see `leaf_hash`
+        """
+        self.levels[0].append(leaf)
+        index = len(self.levels[0]) - 1
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            parent = index // 2
+            left = nodes[2 * parent]
+            right = nodes[2 * parent + 1] if 2 * parent + 1 < len(nodes) else left
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            upper = self.levels[level + 1]
+            if parent < len(upper):
+                upper[parent] = node_hash(left, right)
+            else:
+                upper.append(node_hash(left, right))
+            index = parent
+            level += 1
+
+    @property
+    def mutated(self):
+        """
+        True if two nodes paired together on any level are equal, so that a tree with fewer
+        leaves has the same root
+        """
+        for nodes in self.levels[:-1]:
+            for i in range(0, len(nodes) - 1, 2):
+                if nodes[i] == nodes[i + 1]:
+                    return True
+        return False
+
+    @property
+    def root(self):
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        """
+        Builds the inclusion proof of a leaf
+        Parameters
+        ----------
+        index: position of the leaf
+
+        Returns
+        -------
+        List of (side, hash) pairs, from the leaf up to the root, where side tells whether
+        the sibling is on the 'left' or on the 'right'
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(f'Leaf {index} is not in the tree.')
+        proof = []
+        for nodes in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(nodes):
+                proof.append(('left' if sibling < index else 'right', nodes[sibling]))
+            else:
+                proof.append(('right', nodes[index]))
+            index //= 2
+        return proof
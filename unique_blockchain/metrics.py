@@ -0,0 +1,166 @@
+import bisect
+import json
+import os
+import threading
+from time import perf_counter, time
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Histogram:
+    """
+    Counts of the observed values falling in each bucket, with their total
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is for the values above the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'count': self.count, 'sum': self.sum}
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.metrics.observe(self.name + '.seconds', perf_counter() - self.start, **self.labels)
+        if kind is not None:
+            self.metrics.increment(self.name + '.errors', error=kind.__name__, **self.labels)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """
+    Counters, histograms and spans of the ledger. Metrics are identified by a name and optional
+    labels, e.g. `increment('transactions.rejected', reason='Missing payload')`.
+    When disabled, recording a metric returns straight away.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds `value` to a counter
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Records a value in a histogram. The buckets are fixed by the first observation.
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def span(self, name, **labels):
+        """
+        Context manager timing a block of code into the histogram `<name>.seconds` and counting
+        the exceptions raised inside it in `<name>.errors`
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """
+        Returns
+        -------
+        Dictionary with the time of the snapshot, the counters and the histograms, each as a list
+        of {'name', 'labels', ...} dictionaries
+        """
+        with self._lock:
+            return {
+                'timestamp': time(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'histograms': [dict({'name': name, 'labels': dict(labels)}, **histogram.to_dict())
+                               for (name, labels), histogram in sorted(self.histograms.items(),
+                                                                       key=lambda item: item[0])],
+            }
+
+    def export(self, path):
+        """
+        Writes a snapshot as JSON, replacing the previous one at once so that a scraper never
+        reads a partial file
+        Parameters
+        ----------
+        path: the file of the snapshot
+
+        Returns
+        -------
+        The snapshot
+        """
+        snapshot = self.snapshot()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+        return snapshot
+
+
+# Metrics of the ledger, disabled until `enable` is called
+registry = Metrics()
+
+
+def enable():
+    registry.enabled = True
+
+
+def disable():
+    registry.enabled = False
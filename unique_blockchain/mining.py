@@ -0,0 +1,157 @@
+import hashlib
+import multiprocessing as mp
+import os
+from time import perf_counter
+
+# Number of nounces a worker tries between two checks of the stop flag
+CHECK_EVERY = 4096
+
+# Number of leading zero bits required by default, the same as two leading hex zeros
+DEFAULT_DIFFICULTY = 8
+# Largest target that fits in the 32 bytes of a hash
+MAX_TARGET = (1 << 256) - 1
+
+_stop = None
+
+
+def difficulty_to_target(difficulty):
+    """
+    Converts a difficulty, expressed as number of leading zero bits, to an integer target
+    Parameters
+    ----------
+    difficulty: number of leading zero bits required to the hash
+
+    Returns
+    -------
+    The target that the hash, read as a big-endian integer, must stay below
+    """
+    return min((1 << 256) >> difficulty, MAX_TARGET)
+
+
+DEFAULT_TARGET = difficulty_to_target(DEFAULT_DIFFICULTY)
+
+
+def valid_proof(last_proof, nounce, target=DEFAULT_TARGET):
+    """
+    Checks whether a nounce solves the proof of work for the given last proof
+    Parameters
+    ----------
+    last_proof: nounce of the last block
+    nounce: the candidate nounce
+    target: the hash of the guess must be lower than this value
+
+    Returns
+    -------
+    True if the nounce is valid, False otherwise
+    """
+    guess = f'{last_proof}{nounce}'.encode()
+    guess_hash = hashlib.sha256(guess).digest()
+    return int.from_bytes(guess_hash, 'big') < target
+
+
+def retarget_due(height, retarget_interval=10, target_block_time=None):
+    """
+    Checks whether the block following the block at `height` gets a new target
+    Parameters
+    ----------
+    height: index of the last block
+    retarget_interval: number of blocks after which the difficulty is adjusted
+    target_block_time: desired number of seconds between two blocks. If None, the difficulty never changes.
+    """
+    return target_block_time is not None and height > retarget_interval and (height - 1) % retarget_interval == 0
+
+
+def next_target(target, elapsed, retarget_interval, target_block_time):
+    """
+    Adjusts a target so that the average time between blocks gets back to `target_block_time`.
+    The adjustment is limited to a factor 4 in either direction.
+    Parameters
+    ----------
+    target: the target of the last block
+    elapsed: seconds between the block `retarget_interval` blocks before the last one and the last one
+    retarget_interval: number of blocks after which the difficulty is adjusted
+    target_block_time: desired number of seconds between two blocks
+
+    Returns
+    -------
+    The target of the next block
+    """
+    expected = int(retarget_interval * target_block_time * 1e6)
+    actual = int(elapsed * 1e6)
+    actual = min(max(actual, expected // 4), expected * 4)
+    return min(max(target * actual // expected, 1), MAX_TARGET)
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def _search(task):
+    """
+    Searches the nounces start, start + step, start + 2 * step, ... until a valid one is found
+    or another worker raises the stop flag.
+    Parameters
+    ----------
+    task: tuple (last_proof, start, step, target)
+
+    Returns
+    -------
+    The share searched, the nounce found (None if stopped) and the time spent searching
+    """
+    last_proof, start, step, target = task
+    began = perf_counter()
+    nounce = start
+    while not _stop.is_set():
+        for _ in range(CHECK_EVERY):
+            if valid_proof(last_proof, nounce, target):
+                _stop.set()
+                return start, nounce, perf_counter() - began
+            nounce += step
+    return start, None, perf_counter() - began
+
+
+class MiningPool:
+    """
+    Pool of processes racing on the proof of work. The nounce space is split in as many
+    interleaved shares as there are processes, whatever the number of miners. Each share is
+    assigned to a miner and the miner of the first share to find a valid nounce wins. The shares
+    are assigned round-robin, continuing from one race to the next, so that every miner takes
+    part even when there are more miners than processes.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count()
+        context = mp.get_context()
+        self._stop = context.Event()
+        self._pool = context.Pool(self.processes, initializer=_init_worker, initargs=(self._stop,))
+        # Number of shares assigned so far, to assign the next ones round-robin
+        self._assigned = 0
+
+    def race(self, last_proof, miners, target=DEFAULT_TARGET):
+        """
+        Lets the shares of the nounce space race on the proof of work on behalf of `miners` miners
+        Parameters
+        ----------
+        last_proof: nounce of the last block
+        miners: number of miners taking part to the race
+        target: the target the proof of work must meet
+
+        Returns
+        -------
+        The index of the winning miner, the nounce found and the time its share took to find it
+        """
+        self._stop.clear()
+        shares = self.processes
+        owners = {share: (self._assigned + share) % miners for share in range(shares)}
+        self._assigned += shares
+        tasks = [(last_proof, share, shares, target) for share in range(shares)]
+        winner = None
+        for share, nounce, elapsed in self._pool.imap_unordered(_search, tasks):
+            if nounce is not None and winner is None:
+                winner = (owners[share], nounce, elapsed)
+        return winner
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
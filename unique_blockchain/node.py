@@ -0,0 +1,641 @@
+import asyncio
+import hashlib
+import random
+import struct
+from time import perf_counter, time
+
+from encoding import BLOCK_HEADER, LENGTH, decode_header, encode_header, encode_transaction, iter_transactions
+from forkchoice import MAX_HEADERS, BlockTree, UnknownParentError
+from merkle import MerkleTree, leaf_hash
+from mining import DEFAULT_TARGET, difficulty_to_target, valid_proof
+
+# Type and length of each message
+FRAME = struct.Struct('>BI')
+TX, BLOCK, COMPACT_BLOCK, GET_BLOCK_TXS, BLOCK_TXS, GET_BLOCK, GET_HEADERS, HEADERS, GET_BLOCKS, BLOCK_BODY = range(1, 11)
+MAX_MESSAGE = 32 * 2 ** 20
+
+# Number of blocks asked to a peer in a single request during the synchronization
+BODY_BATCH = 16
+# Seconds after which a block requested during the synchronization is asked again
+BODY_TIMEOUT = 2
+
+# Number of bytes of the transaction id used to identify a transaction in a compact block
+SHORT_ID_SIZE = 6
+
+
+def transaction_id(raw):
+    return hashlib.sha256(raw).digest()
+
+
+def block_hash(raw):
+    """
+    Hash of an encoded block, the same as `Blockchain.hash` of the decoded block
+    """
+    return hashlib.sha256(memoryview(raw)[:BLOCK_HEADER.size]).hexdigest()
+
+
+def pack_block(header, transactions):
+    """
+    Builds an encoded block from its encoded header and its encoded transactions
+    """
+    parts = [bytes(header), LENGTH.pack(len(transactions))]
+    for transaction in transactions:
+        parts.append(LENGTH.pack(len(transaction)))
+        parts.append(bytes(transaction))
+    return b''.join(parts)
+
+
+def merkle_root(raw):
+    """
+    Merkle root of the transactions of an encoded block, None if the tree is mutated
+    """
+    tree = MerkleTree(leaf_hash(transaction) for transaction in iter_transactions(raw))
+    return None if tree.mutated else tree.root
+
+
+class Peer:
+    """
+    Connection to another node. Outgoing messages are queued and written by a dedicated task,
+    so that a slow peer never blocks the node.
+    """
+
+    def __init__(self, node, reader, writer):
+        self.node = node
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue()
+        self.writer_task = asyncio.ensure_future(self._write())
+
+    def send(self, kind, payload):
+        self.queue.put_nowait(FRAME.pack(kind, len(payload)) + bytes(payload))
+
+    async def _write(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                self.writer.write(frame)
+                self.node.bytes_sent += len(frame)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def receive(self):
+        kind, length = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+        if length > MAX_MESSAGE:
+            raise ConnectionError(f'Message of {length} bytes is too large.')
+        payload = await self.reader.readexactly(length)
+        self.node.bytes_received += FRAME.size + length
+        return kind, payload
+
+    def close(self):
+        self.writer_task.cancel()
+        self.writer.close()
+
+
+class Node:
+    """
+    Node of a peer-to-peer network over TCP. It gossips transactions and blocks to its peers,
+    relaying blocks as compact blocks: the header and the short ids of the transactions, which
+    the receiving node fills from its own pool, asking only for the transactions it misses.
+
+    Given a genesis block, the node also follows a chain: it keeps a tree of the headers and
+    connects the blocks of the heaviest branch. A node that falls behind synchronizes headers
+    first, downloading the headers of the missing blocks from a peer and then the blocks from
+    all its peers in parallel. Since the headers are already known, the peers send only the hash
+    and the transactions of each block. A peer sending a malformed message is disconnected.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, max_connections=8, genesis=None, target_block_time=None,
+                 retarget_interval=10):
+        """
+
+        Parameters
+        ----------
+        host: the address to listen on
+        port: the port to listen on, 0 to pick a free one
+        max_connections: maximum number of peers, inbound and outbound
+        genesis: the encoded genesis block of the chain followed by the node. If None, the node
+            only relays blocks.
+        target_block_time: desired number of seconds between two blocks of the chain, see `Blockchain`
+        retarget_interval: number of blocks after which the difficulty of the chain is adjusted
+        """
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.peers = set()
+        self.transactions = {}
+        self.short_ids = {}
+        self.blocks = {}
+        self.first_seen = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._pending = {}
+        self._server = None
+        self._tasks = set()
+        self.tree = None
+        # Blocks whose previous block is unknown, by hash
+        self._orphans = {}
+        # Blocks requested during the synchronization, with the time they are asked again
+        self._requested = {}
+        self._headers_pending = False
+        self._syncing = False
+        # Set during the synchronization when the headers arrive or the tip reaches the heaviest branch
+        self._progress = None
+        if genesis is not None:
+            genesis = bytes(genesis)
+            hash_ = block_hash(genesis)
+            self.tree = BlockTree(decode_header(genesis), hash_, target_block_time, retarget_interval)
+            self.blocks[hash_] = genesis
+            self.first_seen[hash_] = perf_counter()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for peer in list(self.peers):
+            peer.close()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _accept(self, reader, writer):
+        if len(self.peers) >= self.max_connections:
+            writer.close()
+            return
+        await self._serve(Peer(self, reader, writer))
+
+    async def connect(self, host, port):
+        """
+        Opens a connection to another node
+        Returns
+        -------
+        The Peer, or None if the node has already reached `max_connections`
+        """
+        if len(self.peers) >= self.max_connections:
+            return None
+        reader, writer = await asyncio.open_connection(host, port)
+        peer = Peer(self, reader, writer)
+        task = asyncio.ensure_future(self._serve(peer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return peer
+
+    async def _serve(self, peer):
+        self.peers.add(peer)
+        try:
+            while True:
+                kind, payload = await peer.receive()
+                self.handle(peer, kind, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except (ValueError, KeyError, IndexError, struct.error):
+            # Malformed message: the peer is dropped
+            pass
+        finally:
+            self.peers.discard(peer)
+            peer.close()
+
+    def relay(self, kind, payload, source=None):
+        for peer in self.peers:
+            if peer is not source:
+                peer.send(kind, payload)
+
+    def submit_transaction(self, raw, source=None):
+        """
+        Adds an encoded transaction to the pool of the node and gossips it to the peers
+        Returns
+        -------
+        True if the transaction was new
+        """
+        raw = bytes(raw)
+        tx_id = transaction_id(raw)
+        if tx_id in self.transactions:
+            return False
+        self.transactions[tx_id] = raw
+        self.short_ids[tx_id[:SHORT_ID_SIZE]] = tx_id
+        self.relay(TX, raw, source)
+        return True
+
+    def submit_block(self, raw, source=None):
+        """
+        Stores an encoded block whose transactions match its Merkle root and relays it to the peers
+        as a compact block. A node following a chain relays the block only once it becomes the tip,
+        and asks the source for the headers it misses if the previous block is unknown.
+        Returns
+        -------
+        True if the block was new and valid
+        """
+        raw = bytes(raw)
+        hash_ = block_hash(raw)
+        if hash_ in self.blocks:
+            return False
+        if merkle_root(raw) != BLOCK_HEADER.unpack_from(raw)[5]:
+            return False
+        if self.tree is not None:
+            try:
+                self.tree.add_header(decode_header(raw), hash_)
+            except UnknownParentError:
+                self._orphans[hash_] = raw
+                if source is not None:
+                    self.request_headers(source)
+                return False
+            except ValueError:
+                return False
+        self.blocks[hash_] = raw
+        self.first_seen[hash_] = perf_counter()
+        self._requested.pop(hash_, None)
+        for transaction in iter_transactions(raw):
+            tx_id = transaction_id(transaction)
+            if self.transactions.pop(tx_id, None) is not None:
+                self.short_ids.pop(tx_id[:SHORT_ID_SIZE], None)
+        if self.tree is None:
+            self.relay(COMPACT_BLOCK, self.compact(raw), source)
+        else:
+            self._advance(source)
+            if self._progress is not None and self.tree.tip is self.tree.best:
+                self._progress.set()
+        return True
+
+    def _advance(self, source=None):
+        """
+        Moves the tip along the heaviest branch, as far as its blocks are available
+        """
+        tree = self.tree
+        disconnect, connect = tree.path(tree.tip.hash, tree.best.hash)
+        candidate = None
+        for node in connect:
+            if node.hash not in self.blocks:
+                break
+            candidate = node
+        if candidate is None or candidate.work <= tree.tip.work:
+            return
+        tree.set_tip(candidate.hash)
+        if not self._syncing:
+            self.relay(COMPACT_BLOCK, self.compact(self.blocks[candidate.hash]), source)
+        # Blocks received before their parent may extend the new tip
+        for hash_, raw in list(self._orphans.items()):
+            if decode_header(raw)['previous_hash'] in tree:
+                del self._orphans[hash_]
+                self.submit_block(raw)
+
+    def request_headers(self, peer, locator=None):
+        """
+        Asks a peer for the headers following the last block of the locator on its main chain
+        Parameters
+        ----------
+        peer: the Peer
+        locator: list of hashes. By default, the locator of the main chain of the node.
+        """
+        if locator is None:
+            locator = self.tree.locator()
+        self._headers_pending = True
+        peer.send(GET_HEADERS, LENGTH.pack(MAX_HEADERS) + b''.join(bytes.fromhex(hash_) for hash_ in locator))
+
+    def request_blocks(self):
+        """
+        Asks the peers, in turn, for the blocks of the heaviest branch that are missing, in batches
+        of BODY_BATCH blocks
+        """
+        peers = list(self.peers)
+        if not peers:
+            return
+        now = perf_counter()
+        missing = []
+        node = self.tree.best
+        while node is not None and node.hash not in self.blocks:
+            if self._requested.get(node.hash, 0) <= now:
+                missing.append(node.hash)
+            node = node.parent
+        missing.reverse()
+        for i in range(0, len(missing), BODY_BATCH):
+            batch = missing[i:i + BODY_BATCH]
+            for hash_ in batch:
+                self._requested[hash_] = now + BODY_TIMEOUT
+            peers[i // BODY_BATCH % len(peers)].send(GET_BLOCKS, b''.join(bytes.fromhex(hash_) for hash_ in batch))
+
+    async def sync(self, timeout=60):
+        """
+        Catches up with the peers: downloads the headers after the tip of the node from one peer,
+        then the missing blocks of the heaviest branch from all the peers
+        Parameters
+        ----------
+        timeout: seconds to wait for the synchronization to complete
+        """
+        if not self.peers:
+            return
+        self._syncing = True
+        self._progress = asyncio.Event()
+        try:
+            self.request_headers(next(iter(self.peers)))
+            deadline = perf_counter() + timeout
+            while self._headers_pending or self.tree.tip is not self.tree.best:
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError('The synchronization did not complete in time.')
+                self._progress.clear()
+                self.request_blocks()
+                # Without news, the blocks requested are asked again after BODY_TIMEOUT
+                try:
+                    await asyncio.wait_for(self._progress.wait(), min(remaining, BODY_TIMEOUT))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._syncing = False
+            self._progress = None
+
+    @staticmethod
+    def compact(raw):
+        short_ids = [transaction_id(transaction)[:SHORT_ID_SIZE] for transaction in iter_transactions(raw)]
+        return bytes(memoryview(raw)[:BLOCK_HEADER.size]) + LENGTH.pack(len(short_ids)) + b''.join(short_ids)
+
+    def handle(self, peer, kind, payload):
+        if kind == TX:
+            self.submit_transaction(payload, peer)
+        elif kind == BLOCK:
+            self.submit_block(payload, peer)
+        elif kind == COMPACT_BLOCK:
+            self._handle_compact_block(peer, payload)
+        elif kind == GET_BLOCK_TXS:
+            self._handle_get_block_txs(peer, payload)
+        elif kind == BLOCK_TXS:
+            self._handle_block_txs(peer, payload)
+        elif kind == GET_BLOCK:
+            hash_ = payload.hex()
+            if hash_ in self.blocks:
+                peer.send(BLOCK, self.blocks[hash_])
+        elif kind == GET_HEADERS and self.tree is not None:
+            self._handle_get_headers(peer, payload)
+        elif kind == HEADERS and self.tree is not None:
+            self._handle_headers(peer, payload)
+        elif kind == GET_BLOCKS:
+            for i in range(0, len(payload), 32):
+                hash_ = payload[i:i + 32].hex()
+                if hash_ in self.blocks:
+                    peer.send(BLOCK_BODY, payload[i:i + 32] + self.blocks[hash_][BLOCK_HEADER.size:])
+        elif kind == BLOCK_BODY and self.tree is not None:
+            self._handle_block_body(peer, payload)
+
+    def _handle_get_headers(self, peer, payload):
+        limit = min(LENGTH.unpack_from(payload)[0], MAX_HEADERS)
+        locator = [payload[i:i + 32].hex() for i in range(LENGTH.size, len(payload), 32)]
+        nodes = self.tree.headers_after(locator, limit)
+        peer.send(HEADERS, b''.join(self.blocks[node.hash][:BLOCK_HEADER.size] for node in nodes))
+
+    def _handle_headers(self, peer, payload):
+        count = len(payload) // BLOCK_HEADER.size
+        last = None
+        for i in range(count):
+            header = payload[i * BLOCK_HEADER.size:(i + 1) * BLOCK_HEADER.size]
+            last = hashlib.sha256(header).hexdigest()
+            try:
+                self.tree.add_header(decode_header(header), last)
+            except (UnknownParentError, ValueError):
+                # The peer does not follow the same chain
+                count = 0
+                break
+        if count == MAX_HEADERS:
+            # More headers follow the last one
+            self.request_headers(peer, [last])
+            return
+        self._headers_pending = False
+        if self._progress is not None:
+            self._progress.set()
+        if not self._syncing:
+            self.request_blocks()
+
+    def _handle_block_body(self, peer, payload):
+        hash_ = payload[:32].hex()
+        if hash_ in self.blocks or hash_ not in self.tree:
+            return
+        self.submit_block(encode_header(self.tree.nodes[hash_].header) + payload[32:], peer)
+
+    def _handle_compact_block(self, peer, payload):
+        if len(payload) < BLOCK_HEADER.size + LENGTH.size:
+            raise ValueError('Malformed compact block.')
+        count = LENGTH.unpack_from(payload, BLOCK_HEADER.size)[0]
+        if len(payload) != BLOCK_HEADER.size + LENGTH.size + count * SHORT_ID_SIZE:
+            raise ValueError('Malformed compact block.')
+        hash_ = block_hash(payload)
+        if hash_ in self.blocks or hash_ in self._pending:
+            return
+        header = payload[:BLOCK_HEADER.size]
+        if self.tree is not None and decode_header(header)['previous_hash'] not in self.tree:
+            # Missing blocks before this one: synchronize the headers first
+            self.request_headers(peer)
+            return
+        offset = BLOCK_HEADER.size + LENGTH.size
+        slots = []
+        for i in range(count):
+            tx_id = self.short_ids.get(payload[offset + i * SHORT_ID_SIZE:offset + (i + 1) * SHORT_ID_SIZE])
+            slots.append(self.transactions.get(tx_id))
+        missing = [i for i, transaction in enumerate(slots) if transaction is None]
+        if not missing:
+            self._complete(peer, hash_, header, slots)
+            return
+        self._pending[hash_] = (header, slots, missing)
+        request = bytes.fromhex(hash_) + LENGTH.pack(len(missing)) + b''.join(LENGTH.pack(i) for i in missing)
+        peer.send(GET_BLOCK_TXS, request)
+
+    def _handle_get_block_txs(self, peer, payload):
+        if len(payload) < 32 + LENGTH.size:
+            raise ValueError('Malformed request of transactions.')
+        hash_ = payload[:32].hex()
+        if hash_ not in self.blocks:
+            return
+        count = LENGTH.unpack_from(payload, 32)[0]
+        if len(payload) != 32 + LENGTH.size * (count + 1):
+            raise ValueError('Malformed request of transactions.')
+        indexes = struct.unpack_from(f'>{count}I', payload, 32 + LENGTH.size)
+        transactions = list(iter_transactions(self.blocks[hash_]))
+        if any(i >= len(transactions) for i in indexes):
+            raise ValueError(f'Request of transactions out of the block {hash_}.')
+        parts = [payload[:32], LENGTH.pack(count)]
+        for i in indexes:
+            parts.append(LENGTH.pack(len(transactions[i])))
+            parts.append(bytes(transactions[i]))
+        peer.send(BLOCK_TXS, b''.join(parts))
+
+    def _handle_block_txs(self, peer, payload):
+        hash_ = payload[:32].hex()
+        if hash_ not in self._pending:
+            return
+        header, slots, missing = self._pending.pop(hash_)
+        if len(payload) < 32 + LENGTH.size or LENGTH.unpack_from(payload, 32)[0] != len(missing):
+            raise ValueError(f'Malformed transactions of block {hash_}.')
+        offset = 32 + LENGTH.size
+        for i in missing:
+            length = LENGTH.unpack_from(payload, offset)[0]
+            offset += LENGTH.size
+            if offset + length > len(payload):
+                raise ValueError(f'Truncated transactions of block {hash_}.')
+            slots[i] = payload[offset:offset + length]
+            offset += length
+        if offset != len(payload):
+            raise ValueError(f'Malformed transactions of block {hash_}.')
+        self._complete(peer, hash_, header, slots)
+
+    def _complete(self, peer, hash_, header, slots):
+        if not self.submit_block(pack_block(header, slots), peer):
+            # A short id collision gave a wrong transaction: ask for the whole block
+            peer.send(GET_BLOCK, bytes.fromhex(hash_))
+
+
+def _random_transaction(rng):
+    address = bytes(rng.getrandbits(8) for _ in range(32)).hex()
+    return encode_transaction({'type': 'diagnosis', 'sender': address, 'recipient': address,
+                               'illness': f'illness{rng.randrange(1000)}', 'fee': round(rng.random(), 2)})
+
+
+async def _wait(condition, timeout):
+    deadline = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > deadline:
+            raise TimeoutError('The network did not converge in time.')
+        await asyncio.sleep(0.001)
+
+
+async def simulate(nodes=20, degree=4, transactions=500, seed=0, timeout=30):
+    """
+    Runs a network of nodes on localhost, gossips random transactions and then measures the
+    propagation of a block containing all of them.
+    Parameters
+    ----------
+    nodes: number of nodes
+    degree: number of outbound connections of each node
+    transactions: number of transactions in the block
+    seed: seed of the random topology and transactions
+    timeout: seconds to wait for the network to converge
+
+    Returns
+    -------
+    Dictionary with the propagation time to each node and the bytes exchanged to propagate the block
+    """
+    rng = random.Random(seed)
+    network = [Node(max_connections=2 * degree + 2) for _ in range(nodes)]
+    for node in network:
+        await node.start()
+    for i, node in enumerate(network):
+        # A ring keeps the network connected, the other links are random
+        others = [j for j in range(nodes) if j != i]
+        targets = {(i + 1) % nodes} | set(rng.sample(others, min(degree - 1, len(others))))
+        for j in targets:
+            await node.connect(network[j].host, network[j].port)
+    await asyncio.sleep(0.1)
+
+    raw_transactions = [_random_transaction(rng) for _ in range(transactions)]
+    for raw in raw_transactions:
+        rng.choice(network).submit_transaction(raw)
+    await _wait(lambda: all(len(node.transactions) == transactions for node in network), timeout)
+
+    header = encode_header({
+        'index': 1,
+        'timestamp': time(),
+        'merkle_root': MerkleTree(leaf_hash(raw) for raw in raw_transactions).root.hex(),
+        'nounce': 0,
+        'target': DEFAULT_TARGET,
+        'previous_hash': '0' * 64,
+    })
+    raw_block = pack_block(header, raw_transactions)
+    hash_ = block_hash(raw_block)
+    sent = sum(node.bytes_sent for node in network)
+    start = perf_counter()
+    network[0].submit_block(raw_block)
+    await _wait(lambda: all(hash_ in node.blocks for node in network), timeout)
+
+    times = sorted(node.first_seen[hash_] - start for node in network)
+    result = {
+        'nodes': nodes,
+        'block_bytes': len(raw_block),
+        'propagation_median': times[len(times) // 2],
+        'propagation_max': times[-1],
+        'bytes_exchanged': sum(node.bytes_sent for node in network) - sent,
+    }
+    for node in network:
+        await node.stop()
+    return result
+
+
+def _mine_chain(blocks, transactions, difficulty, rng):
+    """
+    Builds the encoded blocks of a chain with a real proof of work, the genesis block first
+    """
+    target = difficulty_to_target(difficulty)
+    raw_blocks = [pack_block(encode_header({
+        'index': 1, 'timestamp': 0.0, 'merkle_root': MerkleTree().root.hex(), 'nounce': 100,
+        'target': target, 'previous_hash': format(1, '064x'),
+    }), [])]
+    last_nounce = 100
+    for index in range(2, blocks + 2):
+        raw_transactions = [_random_transaction(rng) for _ in range(transactions)]
+        nounce = 0
+        while not valid_proof(last_nounce, nounce, target):
+            nounce += 1
+        header = encode_header({
+            'index': index,
+            'timestamp': time(),
+            'merkle_root': MerkleTree(leaf_hash(raw) for raw in raw_transactions).root.hex(),
+            'nounce': nounce,
+            'target': target,
+            'previous_hash': block_hash(raw_blocks[-1]),
+        })
+        raw_blocks.append(pack_block(header, raw_transactions))
+        last_nounce = nounce
+    return raw_blocks
+
+
+async def simulate_sync(blocks=500, missed=None, nodes=4, transactions=20, difficulty=8, seed=0, timeout=60):
+    """
+    Runs a network of nodes following the same chain, then lets a node that missed the last blocks
+    rejoin and measures its synchronization.
+    Parameters
+    ----------
+    blocks: number of blocks after the genesis block
+    missed: number of blocks missed by the late node, all of them by default
+    nodes: number of nodes already synchronized, all connected to the late node
+    transactions: number of transactions in each block
+    difficulty: number of leading zero bits of the proof of work
+    seed: seed of the random transactions
+    timeout: seconds to wait for the network to converge
+
+    Returns
+    -------
+    Dictionary with the time taken by the late node to catch up, the bytes it received and the
+    size of the blocks it missed
+    """
+    missed = blocks if missed is None else missed
+    raw_blocks = _mine_chain(blocks, transactions, difficulty, random.Random(seed))
+    network = [Node(genesis=raw_blocks[0]) for _ in range(nodes)]
+    for node in network:
+        await node.start()
+        for raw in raw_blocks[1:]:
+            node.submit_block(raw)
+    late = Node(genesis=raw_blocks[0])
+    for raw in raw_blocks[1:len(raw_blocks) - missed]:
+        late.submit_block(raw)
+    await late.start()
+    for node in network:
+        await late.connect(node.host, node.port)
+    await _wait(lambda: len(late.peers) == nodes and all(node.peers for node in network), timeout)
+
+    start = perf_counter()
+    await late.sync(timeout)
+    result = {
+        'blocks': blocks,
+        'missed': missed,
+        'sync_time': perf_counter() - start,
+        'bytes_received': late.bytes_received,
+        'missed_bytes': sum(len(raw) for raw in raw_blocks[len(raw_blocks) - missed:]),
+        'synchronized': late.tree.tip.hash == block_hash(raw_blocks[-1]),
+    }
+    for node in network + [late]:
+        await node.stop()
+    return result
+
+
+if __name__ == '__main__':
+    print(asyncio.run(simulate()))
+    print(asyncio.run(simulate_sync()))
@@ -0,0 +1,228 @@
+import glob
+import json
+import os
+
+from history import HistoryIndex
+
+SNAPSHOT_VERSION = 2
+# Number of snapshots kept in their folder, the older ones are deleted
+SNAPSHOTS_KEPT = 3
+# Number of blocks below the last one that can be undone without replaying the chain, as deep as
+# the reorganizations of the Blockchain
+UNDO_DEPTH = 1000
+
+
+def _address(party):
+    return getattr(party, 'address', party)
+
+
+class LedgerState:
+    """
+    State derived from the blocks: the illnesses of each patient, the authorization of each doctor
+    and the index of the history of each patient, all by address. Agents registered to the state
+    share it, so that `patient.illnesses` and `doctor.authorization` are kept up to date as blocks
+    are applied.
+    """
+
+    def __init__(self, height=0, block_hash=None, illnesses=None, authorizations=None, history=None):
+        """
+
+        Parameters
+        ----------
+        height: index of the last block applied to the state
+        block_hash: hash of the last block applied to the state
+        illnesses: dictionary mapping the address of each patient to the list of its illnesses
+        authorizations: dictionary mapping the address of each doctor to its authorization
+        history: the HistoryIndex of the patients
+        """
+        self.height = height
+        self.block_hash = block_hash
+        self.illnesses = illnesses if illnesses is not None else {}
+        self.authorizations = authorizations if authorizations is not None else {}
+        self.history = history if history is not None else HistoryIndex()
+        self.agents = {}
+        # Authorizations replaced by each of the last blocks, as (address, previous authorization) pairs
+        self.undo = {}
+
+    def register(self, agent):
+        """
+        Binds an agent to the state, loading its illnesses or its authorization
+        Parameters
+        ----------
+        agent: a Patient or a Doctor
+        """
+        self.agents[agent.address] = agent
+        if hasattr(agent, 'illnesses'):
+            if agent.address in self.illnesses:
+                agent.illnesses = self.illnesses[agent.address]
+                agent.illness_mask = (None, 0, 0)
+            else:
+                self.illnesses[agent.address] = agent.illnesses
+        if hasattr(agent, 'authorization') and agent.address in self.authorizations:
+            agent.authorization = self.authorizations[agent.address]
+
+    def rebind(self, agents):
+        """
+        Registers the agents of another state, replacing their illnesses and their authorization
+        with the ones of this state
+        Parameters
+        ----------
+        agents: dictionary mapping addresses to Patient or Doctor objects
+        """
+        for address, agent in agents.items():
+            if hasattr(agent, 'illnesses'):
+                agent.illnesses = self.illnesses.setdefault(address, [])
+                agent.illness_mask = (None, 0, 0)
+            if hasattr(agent, 'authorization'):
+                agent.authorization = self.authorizations.get(address)
+            self.agents[address] = agent
+
+    def apply_block(self, block, block_hash):
+        """
+        Applies the transactions of a block to the state
+        Parameters
+        ----------
+        block: the dictionary representing the block
+        block_hash: the hash of the block
+
+        Returns
+        -------
+        The list of the addresses of the doctors whose authorization changed
+        """
+        changed = []
+        replaced = []
+        for transaction in block['transactions']:
+            recipient = transaction['recipient']
+            address = _address(recipient)
+            if address not in self.agents and not isinstance(recipient, str):
+                self.register(recipient)
+            if transaction['type'] == 'diagnosis':
+                self.illnesses.setdefault(address, []).append(transaction['illness'])
+            if transaction['type'] == 'authorization':
+                authorization = transaction['authorization']
+                replaced.append((address, self.authorizations.get(address)))
+                self.authorizations[address] = authorization
+                if address in self.agents:
+                    self.agents[address].authorization = authorization
+                changed.append(address)
+        self.history.add_block(block)
+        self.height = block['index']
+        self.block_hash = block_hash
+        self.undo[block['index']] = replaced
+        self.undo.pop(block['index'] - UNDO_DEPTH, None)
+        return changed
+
+    def undo_block(self, block):
+        """
+        Reverts the transactions of the last block applied to the state
+        Parameters
+        ----------
+        block: the dictionary representing the block
+
+        Returns
+        -------
+        The list of the addresses of the doctors whose authorization changed
+
+        Raises
+        ------
+        ValueError
+            If the block is not the last one applied, if its undo data was dropped or if the state
+            does not match the block. The state must then be rebuilt.
+        """
+        if block['index'] != self.height or block['index'] not in self.undo:
+            raise ValueError(f"Block {block['index']} cannot be undone.")
+        replaced = self.undo.pop(block['index'])
+        changed = []
+        for transaction in reversed(block['transactions']):
+            if transaction['type'] != 'diagnosis':
+                continue
+            address = _address(transaction['recipient'])
+            illnesses = self.illnesses.get(address)
+            if not illnesses or illnesses[-1] != transaction['illness']:
+                raise ValueError(f"Block {block['index']} does not match the illnesses of {address}.")
+            illnesses.pop()
+            agent = self.agents.get(address)
+            if agent is not None and hasattr(agent, 'illness_mask'):
+                agent.illness_mask = (None, 0, 0)
+        for address, authorization in reversed(replaced):
+            if authorization is None:
+                self.authorizations.pop(address, None)
+            else:
+                self.authorizations[address] = authorization
+            if address in self.agents:
+                self.agents[address].authorization = authorization
+            changed.append(address)
+        self.history.remove_block(block)
+        self.height = block['index'] - 1
+        self.block_hash = block['previous_hash']
+        return changed
+
+    def to_dict(self):
+        return {
+            'version': SNAPSHOT_VERSION,
+            'height': self.height,
+            'hash': self.block_hash,
+            'illnesses': self.illnesses,
+            'authorizations': {address: bytes(authorization).hex()
+                               for address, authorization in self.authorizations.items()},
+            'history': self.history.entries,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {data['version']}.")
+        return cls(height=data['height'], block_hash=data['hash'], illnesses=data['illnesses'],
+                   authorizations={address: bytes.fromhex(authorization)
+                                   for address, authorization in data['authorizations'].items()},
+                   history=HistoryIndex(data['history']))
+
+
+def save_snapshot(state, directory, keep=SNAPSHOTS_KEPT):
+    """
+    Writes a snapshot of the state, tagged with the height and the hash of its last block, and
+    deletes the older snapshots beyond the most recent `keep`.
+    The snapshot is written synchronously: its cost grows with the size of the state, so the
+    block that triggers it is slower than the others.
+    Parameters
+    ----------
+    state: the LedgerState
+    directory: folder containing the snapshots, created if it does not exist
+    keep: number of snapshots kept, including the new one
+
+    Returns
+    -------
+    The path of the snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'snapshot-{state.height:010d}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state.to_dict(), f)
+    # The snapshot appears only once it is complete
+    os.replace(path + '.tmp', path)
+    for old in sorted(glob.glob(os.path.join(directory, 'snapshot-*.json')), reverse=True)[keep:]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+    return path
+
+
+def load_snapshots(directory):
+    """
+    Loads the snapshots of a folder, from the most recent to the oldest.
+    Snapshots that cannot be read are skipped.
+    Parameters
+    ----------
+    directory: folder containing the snapshots
+
+    Returns
+    -------
+    Generator of LedgerState objects
+    """
+    for path in sorted(glob.glob(os.path.join(directory, 'snapshot-*.json')), reverse=True):
+        try:
+            with open(path) as f:
+                yield LedgerState.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            continue
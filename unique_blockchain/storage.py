@@ -0,0 +1,239 @@
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+from encoding import decode_block, encode_block
+
+INDEX_MAGIC = b'HBIX'
+# Magic and number of blocks, padded to the size of a record
+INDEX_HEADER = struct.Struct('>4sQ4x')
+# Segment number, offset inside the segment and length of each block
+INDEX_RECORD = struct.Struct('>IQI')
+# Number of records added to the index file each time it is full
+INDEX_GROWTH = 4096
+# File of the store holding the seed of the key of the Minister who signs the authorizations
+MINISTER_KEY = 'minister.key'
+
+
+class BlockStore:
+    """
+    Append-only store of encoded blocks. Blocks are appended to segment files, and a memory-mapped
+    index of fixed-width records gives the position of block `i` in O(1).
+    Segments that are no longer written are memory-mapped on first access.
+    """
+
+    def __init__(self, directory, segment_size=64 * 2 ** 20, sync=False):
+        """
+
+        Parameters
+        ----------
+        directory: folder containing the segments and the index, created if it does not exist
+        segment_size: size in bytes after which a new segment is started
+        sync: if True, segments and index are flushed to disk after each block
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+
+        index_path = os.path.join(directory, 'index.dat')
+        if not os.path.exists(index_path):
+            with open(index_path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, 0))
+                f.truncate(INDEX_HEADER.size + INDEX_GROWTH * INDEX_RECORD.size)
+        self._index_file = open(index_path, 'r+b')
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        magic, self._count = INDEX_HEADER.unpack_from(self._index)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'{index_path} is not a block index.')
+
+        self._segment = self._record(self._count - 1)[0] if self._count else 0
+        self._writer = open(self._segment_path(self._segment), 'ab')
+        self._sealed = {}
+
+    def __len__(self):
+        return self._count
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'segment-{segment:06d}.dat')
+
+    def _record(self, i):
+        return INDEX_RECORD.unpack_from(self._index, INDEX_HEADER.size + i * INDEX_RECORD.size)
+
+    def _grow_index(self):
+        self._index.flush()
+        self._index.close()
+        self._index_file.truncate(INDEX_HEADER.size + (self._count + INDEX_GROWTH) * INDEX_RECORD.size)
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+    def append(self, data):
+        """
+        Appends an encoded block
+        Parameters
+        ----------
+        data: the encoded block
+
+        Returns
+        -------
+        The position of the block in the store
+        """
+        offset = self._writer.tell()
+        if offset and offset + len(data) > self.segment_size:
+            self._writer.close()
+            self._segment += 1
+            # No indexed block is in the new segment: bytes left there by a truncation or by a
+            # crash before the index was updated are overwritten
+            self._writer = open(self._segment_path(self._segment), 'wb')
+            offset = 0
+        self._writer.write(data)
+        self._writer.flush()
+
+        if INDEX_HEADER.size + (self._count + 1) * INDEX_RECORD.size > len(self._index):
+            self._grow_index()
+        INDEX_RECORD.pack_into(self._index, INDEX_HEADER.size + self._count * INDEX_RECORD.size,
+                               self._segment, offset, len(data))
+        self._count += 1
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self._count)
+        if self.sync:
+            os.fsync(self._writer.fileno())
+            self._index.flush()
+        return self._count - 1
+
+    def truncate(self, count):
+        """
+        Drops the blocks from position `count` onwards. Their bytes stay in the segments but are
+        no longer indexed.
+        """
+        if not 0 <= count <= self._count:
+            raise IndexError(f'Cannot truncate {self._count} blocks to {count}.')
+        self._count = count
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self._count)
+        if self.sync:
+            self._index.flush()
+
+    def get(self, i):
+        """
+        Reads an encoded block
+        Parameters
+        ----------
+        i: the position of the block in the store
+
+        Returns
+        -------
+        The encoded block
+        """
+        if not 0 <= i < self._count:
+            raise IndexError(f'Block {i} is not in the store.')
+        segment, offset, length = self._record(i)
+        if segment == self._segment:
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                return f.read(length)
+        if segment not in self._sealed:
+            with open(self._segment_path(segment), 'rb') as f:
+                self._sealed[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._sealed[segment][offset:offset + length]
+
+    def close(self):
+        self._writer.close()
+        self._index.flush()
+        self._index.close()
+        self._index_file.close()
+        for segment in self._sealed.values():
+            segment.close()
+        self._sealed = {}
+
+
+class PersistentChain:
+    """
+    List-like view of the blocks in a BlockStore, to be used as `Blockchain.chain`.
+    The most recent blocks are kept in memory as they were appended, the others are decoded
+    from the store when accessed, with the agents replaced by their addresses.
+    """
+
+    def __init__(self, store, cache_size=1024):
+        """
+
+        Parameters
+        ----------
+        store: the BlockStore holding the blocks
+        cache_size: number of blocks kept in memory
+        """
+        self.store = store
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.store)
+
+    def _remember(self, i, block):
+        self._cache[i] = block
+        self._cache.move_to_end(i)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('chain index out of range')
+        if i in self._cache:
+            self._cache.move_to_end(i)
+            return self._cache[i]
+        block = decode_block(self.store.get(i))
+        self._remember(i, block)
+        return block
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, block):
+        self._remember(self.store.append(encode_block(block)), block)
+
+    def truncate(self, count):
+        self.store.truncate(count)
+        for i in [i for i in self._cache if i >= count]:
+            del self._cache[i]
+
+    def close(self):
+        self.store.close()
+
+
+def save_minister_key(directory, minister):
+    """
+    Writes the seed of the key of the Minister next to the blocks, so that the chain can be
+    reopened with the same Minister
+    Parameters
+    ----------
+    directory: folder of the BlockStore
+    minister: the Minister
+    """
+    path = os.path.join(directory, MINISTER_KEY)
+    with open(path + '.tmp', 'w') as f:
+        f.write(minister.minister_key.encode().hex())
+    os.replace(path + '.tmp', path)
+
+
+def load_minister_key(directory):
+    """
+    Reads the seed of the key of the Minister saved with a BlockStore
+    Parameters
+    ----------
+    directory: folder of the BlockStore
+
+    Returns
+    -------
+    The 32 bytes seed, or None if the store has no key
+    """
+    try:
+        with open(os.path.join(directory, MINISTER_KEY)) as f:
+            return bytes.fromhex(f.read().strip())
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,65 @@
+from time import time
+
+import pytest
+
+from agents import Doctor, Minister
+from blockchain import Blockchain
+from encoding import encode_block
+from merkle import MerkleTree, leaf_hash
+from node import Node
+
+
+def test_repeated_last_leaf_is_mutated():
+    leaves = [leaf_hash(bytes([i])) for i in range(3)]
+    honest = MerkleTree(leaves)
+    tampered = MerkleTree(leaves + leaves[-1:])
+    assert honest.root == tampered.root
+    assert not honest.mutated
+    assert tampered.mutated
+
+
+def test_repeated_subtree_is_mutated():
+    leaves = [leaf_hash(bytes([i])) for i in range(6)]
+    assert MerkleTree(leaves + leaves[4:]).root == MerkleTree(leaves).root
+    assert MerkleTree(leaves + leaves[4:]).mutated
+
+
+def _blocks(blockchain):
+    """
+    Builds the next block with three transactions, and a copy repeating the last one
+    """
+    for name in ('a', 'b', 'c'):
+        blockchain.new_authorization(Doctor(name), 0.1)
+    blockchain.assemble_block()
+    transactions = list(blockchain.current_transactions)
+    blockchain.current_transactions = []
+    blockchain.merkle_tree = MerkleTree()
+    honest = {
+        'index': len(blockchain.chain) + 1,
+        'timestamp': time(),
+        'transactions': transactions,
+        'merkle_root': MerkleTree(blockchain.transaction_hash(t) for t in transactions).root.hex(),
+        'nounce': blockchain.proof_of_work(blockchain.last_block['nounce']),
+        'target': blockchain.target,
+        'previous_hash': blockchain.hash(blockchain.last_block),
+    }
+    tampered = dict(honest, transactions=transactions + transactions[-1:])
+    return honest, tampered
+
+
+def test_tampered_block_does_not_ban_the_honest_one():
+    blockchain = Blockchain(Minister, {}, difficulty=1)
+    honest, tampered = _blocks(blockchain)
+    assert blockchain.hash(honest) == blockchain.hash(tampered)
+    with pytest.raises(ValueError):
+        blockchain.receive_block(tampered)
+    assert blockchain.receive_block(honest)
+    assert len(blockchain.chain) == 2
+
+
+def test_node_rejects_tampered_block():
+    blockchain = Blockchain(Minister, {}, difficulty=1)
+    honest, tampered = _blocks(blockchain)
+    node = Node()
+    assert not node.submit_block(encode_block(tampered))
+    assert node.submit_block(encode_block(honest))
@@ -0,0 +1,238 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from encoding import PAYLOAD_KEYS, encode_transaction
+from metrics import registry
+
+
+class ValidationReport:
+    """
+    Outcome of the validation of a list of transactions
+    """
+
+    def __init__(self, transactions):
+        self.transactions = transactions
+        self.rejected = []
+        self._rejected_positions = set()
+
+    def reject(self, position, stage, reason):
+        self.rejected.append({
+            'position': position,
+            'transaction': self.transactions[position],
+            'stage': stage,
+            'reason': reason
+        })
+        self._rejected_positions.add(position)
+
+    @property
+    def accepted(self):
+        """
+        The transactions that passed every stage, in their original order
+        """
+        return [transaction for position, transaction in enumerate(self.transactions)
+                if position not in self._rejected_positions]
+
+    def reasons(self):
+        """
+        Returns
+        -------
+        Dictionary counting the rejected transactions for each reason
+        """
+        counts = {}
+        for rejection in self.rejected:
+            counts[rejection['reason']] = counts.get(rejection['reason'], 0) + 1
+        return counts
+
+
+class ValidationStage:
+    """
+    A stage of the validation pipeline. `check` receives a list of transactions and returns, for
+    each of them, None if it is valid or the reason why it is rejected.
+    Stages whose checks do not depend on the other transactions are `chunkable`, meaning that the
+    pipeline may split their input in chunks and check them in parallel.
+    """
+    name = None
+    chunkable = False
+
+    def check(self, blockchain, transactions):
+        raise NotImplementedError
+
+
+class StructuralStage(ValidationStage):
+    """
+    Checks that the transactions are well formed
+    """
+    name = 'structure'
+    chunkable = True
+
+    @staticmethod
+    def _is_address(party):
+        address = getattr(party, 'address', party)
+        try:
+            return isinstance(address, str) and len(bytes.fromhex(address)) == 32
+        except ValueError:
+            return False
+
+    def _reason(self, transaction):
+        kind = transaction.get('type')
+        if kind not in PAYLOAD_KEYS:
+            return 'Unknown transaction type'
+        if PAYLOAD_KEYS[kind] not in transaction:
+            return 'Missing payload'
+        if not self._is_address(transaction.get('sender')) or not self._is_address(transaction.get('recipient')):
+            return 'Not valid sender or recipient'
+        fee = transaction.get('fee')
+        if not isinstance(fee, (int, float)) or not math.isfinite(fee) or fee < 0:
+            return 'Not valid fee'
+        payload = transaction[PAYLOAD_KEYS[kind]]
+        if kind == 'authorization':
+            if not isinstance(payload, (bytes, bytearray)):
+                return 'Missing payload'
+        elif not isinstance(payload, str):
+            return 'Missing payload'
+        return None
+
+    def check(self, blockchain, transactions):
+        return [self._reason(transaction) for transaction in transactions]
+
+
+class DuplicateStage(ValidationStage):
+    """
+    Rejects the copies of a transaction appearing earlier in the same list
+    """
+    name = 'duplicates'
+
+    def check(self, blockchain, transactions):
+        seen = set()
+        reasons = []
+        for transaction in transactions:
+            encoded = encode_transaction(transaction)
+            reasons.append('Duplicated transaction' if encoded in seen else None)
+            seen.add(encoded)
+        return reasons
+
+
+class AuthorizationStage(ValidationStage):
+    """
+    Checks the authorization signed by the Minister: the one being granted for authorization
+    transactions, the one of the sending doctor for all the others
+    """
+    name = 'authorization'
+
+    def check(self, blockchain, transactions):
+        authorizations = []
+        for transaction in transactions:
+            if transaction['type'] == 'authorization':
+                recipient = transaction['recipient']
+                authorizations.append((getattr(recipient, 'address', recipient), transaction['authorization']))
+            elif isinstance(transaction['sender'], str):
+                # Blocks decoded from the store or the network only carry addresses
+                sender = transaction['sender']
+                authorizations.append((sender, blockchain.state.authorizations.get(sender)))
+            else:
+                sender = transaction['sender']
+                authorizations.append((sender.address, getattr(sender, 'authorization', None)))
+        valid = blockchain.verifier.verify_many(authorizations)
+
+        reasons = []
+        for transaction, is_valid in zip(transactions, valid):
+            if is_valid:
+                reasons.append(None)
+            elif transaction['type'] == 'authorization':
+                reasons.append('Not valid authorization')
+            else:
+                reasons.append('Not valid Doctor authorization')
+        return reasons
+
+
+class IncompatibilityStage(ValidationStage):
+    """
+    Checks the prescriptions against the history of the patients
+    """
+    name = 'incompatibility'
+    chunkable = True
+
+    def check(self, blockchain, transactions):
+        matrix = blockchain.incompatibility_matrix
+        prescriptions = [position for position, transaction in enumerate(transactions)
+                         if transaction['type'] == 'prescription']
+        masks = []
+        for position in prescriptions:
+            recipient = transactions[position]['recipient']
+            if isinstance(recipient, str):
+                masks.append(matrix.illness_mask(blockchain.state.illnesses.get(recipient, ())))
+            else:
+                masks.append(matrix.patient_mask(recipient))
+        compatible = matrix.compatible_many([transactions[position]['prescription'] for position in prescriptions],
+                                            masks)
+
+        reasons = [None] * len(transactions)
+        for position, is_compatible in zip(prescriptions, compatible):
+            if not is_compatible:
+                reasons[position] = 'Incompatibility of one prescription with the history of the patient'
+        return reasons
+
+
+class ValidationPipeline:
+    """
+    Runs the transactions through a sequence of stages. Each stage makes a single pass over the
+    transactions that survived the previous ones.
+    """
+
+    def __init__(self, stages=None, chunk_size=None, max_workers=None):
+        """
+
+        Parameters
+        ----------
+        stages: list of ValidationStage. By default, structural checks, duplicates, authorization
+            and incompatibility.
+        chunk_size: if specified, the chunkable stages split longer inputs in chunks of this size
+            and check them in a pool of threads
+        max_workers: number of threads checking the chunks
+        """
+        if stages is None:
+            stages = [StructuralStage(), DuplicateStage(), AuthorizationStage(), IncompatibilityStage()]
+        self.stages = stages
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _check(self, stage, blockchain, transactions):
+        if not stage.chunkable or self.chunk_size is None or len(transactions) <= self.chunk_size:
+            return stage.check(blockchain, transactions)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        chunks = [transactions[i:i + self.chunk_size] for i in range(0, len(transactions), self.chunk_size)]
+        reasons = []
+        for chunk_reasons in self._executor.map(lambda chunk: stage.check(blockchain, chunk), chunks):
+            reasons.extend(chunk_reasons)
+        return reasons
+
+    def run(self, blockchain, transactions):
+        """
+        Validates a list of transactions
+        Parameters
+        ----------
+        blockchain: the Blockchain the transactions are validated against
+        transactions: list of transactions
+
+        Returns
+        -------
+        A ValidationReport
+        """
+        report = ValidationReport(transactions)
+        positions = list(range(len(transactions)))
+        metrics = getattr(blockchain, 'metrics', registry)
+        for stage in self.stages:
+            if not positions:
+                break
+            with metrics.span('validation.stage', stage=stage.name):
+                reasons = self._check(stage, blockchain, [transactions[position] for position in positions])
+            survivors = []
+            for position, reason in zip(positions, reasons):
+                if reason is None:
+                    survivors.append(position)
+                else:
+                    report.reject(position, stage.name, reason)
+            positions = survivors
+        return report
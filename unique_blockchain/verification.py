@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import nacl.encoding
+import nacl.exceptions
+import nacl.signing
+
+# Below this number of new signatures, the thread pool costs more than it saves
+BATCH_THRESHOLD = 16
+# Number of signatures whose outcome is remembered for each doctor, the oldest are forgotten first
+SIGNATURES_PER_ADDRESS = 4
+
+
+class AuthorizationVerifier:
+    """
+    Verifies the authorizations signed by the Minister, remembering the outcome for each
+    (doctor address, signature) pair. An authorization is valid only if the Minister signed the
+    address of the doctor holding it. New signatures are verified in batches by a pool of threads,
+    which run in parallel since libsodium releases the GIL.
+    """
+
+    def __init__(self, public_key, max_workers=None):
+        """
+
+        Parameters
+        ----------
+        public_key: the hex encoded public key of the Minister
+        max_workers: number of threads verifying new signatures
+        """
+        self.verify_key = nacl.signing.VerifyKey(public_key, encoder=nacl.encoding.HexEncoder)
+        self.max_workers = max_workers
+        self.cache = {}
+        self._executor = None
+
+    def _verify(self, pair):
+        address, signature = pair
+        try:
+            return self.verify_key.verify(signature) == address.encode('utf-8')
+        except (nacl.exceptions.BadSignatureError, ValueError, TypeError, AttributeError):
+            return False
+
+    @staticmethod
+    def _signature_bytes(signature):
+        try:
+            return bytes(signature)
+        except TypeError:
+            return None
+
+    def is_valid(self, address, signature):
+        """
+        Checks a single authorization
+        Parameters
+        ----------
+        address: address of the doctor holding the authorization
+        signature: the authorization signed by the Minister
+
+        Returns
+        -------
+        True if the authorization is valid, False otherwise
+        """
+        return self.verify_many([(address, signature)])[0]
+
+    def verify_many(self, authorizations):
+        """
+        Checks many authorizations at once, verifying only the signatures that are not cached
+        Parameters
+        ----------
+        authorizations: list of (doctor address, signature) pairs
+
+        Returns
+        -------
+        List of booleans, one for each pair
+        """
+        pairs = [(address, self._signature_bytes(signature)) for address, signature in authorizations]
+        known = {}
+        missing = set()
+        for pair in pairs:
+            address, signature = pair
+            if signature is None:
+                continue
+            cached = self.cache.get(address, {})
+            if signature in cached:
+                known[pair] = cached[signature]
+            else:
+                missing.add(pair)
+        missing = list(missing)
+        if len(missing) >= BATCH_THRESHOLD:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            outcomes = self._executor.map(self._verify, missing)
+        else:
+            outcomes = map(self._verify, missing)
+        for (address, signature), outcome in zip(missing, outcomes):
+            known[(address, signature)] = outcome
+            cached = self.cache.setdefault(address, {})
+            cached[signature] = outcome
+            if len(cached) > SIGNATURES_PER_ADDRESS:
+                del cached[next(iter(cached))]
+
+        return [known.get(pair, False) for pair in pairs]
+
+    def invalidate(self, address):
+        """
+        Forgets the cached outcomes of a doctor, to be called when its authorization changes
+        Parameters
+        ----------
+        address: address of the doctor
+        """
+        self.cache.pop(address, None)